@@ -1,8 +1,13 @@
+import argparse
 import os
+import random
+import sys
+import numpy as np
 import pandas as pd
 import sqlite3
 import time
 import logging
+from concurrent.futures import ProcessPoolExecutor
 from dotenv import load_dotenv
 
 logging.basicConfig(
@@ -12,39 +17,61 @@ logging.basicConfig(
 )
 
 # Constants for performance tuning
-BATCH_SIZE = 100
+BATCH_SIZE = 10000
 MAX_RETRY_ATTEMPTS = 3
 RETRY_DELAY_BASE = 0.5
-BIRTHDATE_BATCH_SIZE = 50
+RETRY_DELAY_MAX = 2.0
+
+# Version of the importer's schema migration, recorded in the schema_version table. The app tracks its own
+# schema steps in PRAGMA user_version, so the importer keeps a separate counter.
+IMPORT_SCHEMA_VERSION = 1
 
 
 load_dotenv()
 EXCEL_FILES = os.getenv("EXCEL_FILES", "").split(",")
 DB_FILE = os.getenv("DB_FILE", "../database/patient_records.db")
 
+# Let sqlite3 bind pandas' missing-value marker and the numpy integers that nullable integer columns
+# yield, so DataFrame rows can go to executemany without first converting every cell to a Python object.
+# NaN floats already bind as NULL.
+sqlite3.register_adapter(type(pd.NA), lambda value: None)
+for numpy_int in (np.int8, np.int16, np.int32, np.int64):
+    sqlite3.register_adapter(numpy_int, int)
+
 
-def execute_with_retry(cursor, query, params=None, is_many=False, max_attempts=MAX_RETRY_ATTEMPTS):
+def execute_with_retry(cursor, query, params=None, is_many=False, max_attempts=MAX_RETRY_ATTEMPTS, is_script=False):
     for attempt in range(max_attempts):
         try:
+            if is_script:
+                return cursor.executescript(query)
             if is_many:
                 return cursor.executemany(query, params)
             else:
                 return cursor.execute(query, params if params is not None else [])
         except sqlite3.OperationalError as e:
             if "database is locked" in str(e) and attempt < max_attempts - 1:
-                delay = RETRY_DELAY_BASE * (2 ** attempt)  # Exponential backoff
+                # Exponential backoff with full jitter, so competing writers don't retry in lockstep
+                delay = random.uniform(0, min(RETRY_DELAY_BASE * (2 ** attempt), RETRY_DELAY_MAX))
                 logging.warning(f"Database locked, retrying in {delay:.2f}s (attempt {attempt + 1}/{max_attempts})")
                 time.sleep(delay)
                 continue
             raise
 
 
-def migrate_database():
-    conn = sqlite3.connect(DB_FILE)
+def migrate_database(db_file):
+    conn = sqlite3.connect(db_file)
     cursor = conn.cursor()
     try:
-        # Start a transaction
-        cursor.execute("BEGIN TRANSACTION")
+        # Start a transaction, taking the write lock up front
+        cursor.execute("BEGIN IMMEDIATE")
+
+        # A database that already recorded this migration skips all the column and index checks below
+        cursor.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER PRIMARY KEY)")
+        cursor.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+        if cursor.fetchone()[0] >= IMPORT_SCHEMA_VERSION:
+            conn.commit()
+            print(f"Database schema is already at version {IMPORT_SCHEMA_VERSION}")
+            return
 
         # Add visit_time column if it doesn't exist
         cursor.execute("PRAGMA table_info(patient_visits)")
@@ -151,6 +178,8 @@ def migrate_database():
         else:
             print("activity_log table already exists")
 
+        cursor.execute("INSERT INTO schema_version (version) VALUES (?)", (IMPORT_SCHEMA_VERSION,))
+
         # Commit the transaction
         conn.commit()
         print("Migration completed successfully!")
@@ -161,15 +190,39 @@ def migrate_database():
         conn.close()
 
 
-conn = sqlite3.connect(DB_FILE)
-conn.row_factory = sqlite3.Row
-cursor = conn.cursor()
+goals_mapping = {
+    "INCREASED DAILY FRUIT/ VEGETABLE PORTIONS": "increased_fruit_veg",
+    "INCREASE DAILY WATER INTAKE": "increased_water",
+    "INCREASED WEEKLY EXERCISE": "increased_exercise",
+    "CUT TV VIEWING TO < 2 HOURS/ DAY": "cut_tv_viewing",
+    "EAT BREAKFAST DAILY": "eat_breakfast",
+    "LIMIT DAILY ALCOHOL CONSUMPTION WOMAN =1, MAN=2": "limit_alcohol",
+    "DO NOT EAT AT LEAST 3 HOURS BEFORE GOING TO BED": "no_late_eating",
+    "EATS MORE WHOLE WHEAT/ GRAINS DAILY": "more_whole_grains",
+    "EATS LESS FRIED FOODS OR MEATS": "less_fried_foods",
+    "DRINKS LOW FAT OR SKIM MILK": "low_fat_milk",
+    "LOWERED SALT INTAKE": "lower_salt",
+    "RECEIVE AN ANNUAL CHECK-UP": "annual_checkup",
+    "QUIT SMOKING": "quit_smoking"
+}
 
-execute_with_retry(cursor, "PRAGMA journal_mode=WAL")
-execute_with_retry(cursor, "PRAGMA synchronous=NORMAL")
+# Connection settings, tables and indexes, applied in one executescript call.
+# Bulk-load tuning: the WAL is appended to without fsync (synchronous=OFF) while files are imported.
+# The database also holds records entered through the app, which cannot be recreated from the
+# workbooks, so the database file itself is never written unsynced: automatic checkpoints are off
+# for this connection, and run() restores synchronous=NORMAL before its one checkpoint at the end.
+# Foreign keys are not enforced while loading, as with MySQL's foreign_key_checks=0 for bulk loads;
+# they are checked once after every file has been imported.
+SCHEMA_SQL = f'''
+PRAGMA journal_mode=WAL;
+PRAGMA busy_timeout=5000;
+PRAGMA foreign_keys=OFF;
+PRAGMA synchronous=OFF;
+PRAGMA wal_autocheckpoint=0;
+PRAGMA temp_store=MEMORY;
+PRAGMA cache_size=-262144;
+PRAGMA mmap_size=268435456;
 
-# Create tables if they don't exist
-execute_with_retry(cursor, '''
 CREATE TABLE IF NOT EXISTS patients (
     client_id TEXT PRIMARY KEY,
     first_name TEXT,
@@ -186,9 +239,7 @@ CREATE TABLE IF NOT EXISTS patients (
     height FLOAT
 
 );
-''')
 
-execute_with_retry(cursor, '''
 CREATE TABLE IF NOT EXISTS activity_log (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     activity_type TEXT NOT NULL,
@@ -198,9 +249,7 @@ CREATE TABLE IF NOT EXISTS activity_log (
     timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
     additional_info TEXT
 );
-''')
 
-execute_with_retry(cursor, '''
 CREATE TABLE IF NOT EXISTS patient_visits (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
     client_id TEXT,
@@ -223,25 +272,10 @@ CREATE TABLE IF NOT EXISTS patient_visits (
     acquired_by TEXT,
     FOREIGN KEY (client_id) REFERENCES patients(client_id)
 );
-''')
 
-goals_mapping = {
-    "INCREASED DAILY FRUIT/ VEGETABLE PORTIONS": "increased_fruit_veg",
-    "INCREASE DAILY WATER INTAKE": "increased_water",
-    "INCREASED WEEKLY EXERCISE": "increased_exercise",
-    "CUT TV VIEWING TO < 2 HOURS/ DAY": "cut_tv_viewing",
-    "EAT BREAKFAST DAILY": "eat_breakfast",
-    "LIMIT DAILY ALCOHOL CONSUMPTION WOMAN =1, MAN=2": "limit_alcohol",
-    "DO NOT EAT AT LEAST 3 HOURS BEFORE GOING TO BED": "no_late_eating",
-    "EATS MORE WHOLE WHEAT/ GRAINS DAILY": "more_whole_grains",
-    "EATS LESS FRIED FOODS OR MEATS": "less_fried_foods",
-    "DRINKS LOW FAT OR SKIM MILK": "low_fat_milk",
-    "LOWERED SALT INTAKE": "lower_salt",
-    "RECEIVE AN ANNUAL CHECK-UP": "annual_checkup",
-    "QUIT SMOKING": "quit_smoking"
-}
+-- Visit lookups during import (and in the app) filter on client_id and visit_date together
+CREATE INDEX IF NOT EXISTS idx_pv_client_date ON patient_visits(client_id, visit_date);
 
-execute_with_retry(cursor, f'''
 CREATE TABLE IF NOT EXISTS patients_goals (
     client_id TEXT,
     visit_date TEXT,
@@ -249,466 +283,458 @@ CREATE TABLE IF NOT EXISTS patients_goals (
     PRIMARY KEY (client_id, visit_date),
     FOREIGN KEY (client_id) REFERENCES patients(client_id)
 );
-''')
-
-conn.commit()
-
-# Run the database migration before processing any files
-print("\nStarting database migration to add visit_time and link goals to visits...")
-migrate_database()
-print("Migration completed. Beginning to process files...")
-
-def extract_birthdate(client_id):
-    if client_id and len(client_id) >= 8:
-        birthdate_part = client_id[-6:]
-        if birthdate_part.isdigit():
-            month = birthdate_part[0:2]
-            day = birthdate_part[2:4]
-            year = birthdate_part[4:6]
-            return f"{month}/{day}/{year}"
-    return None
 
+-- Indexes dropped by --fast-import, kept until they are rebuilt so an interrupted import can restore them
+CREATE TABLE IF NOT EXISTS import_dropped_indexes (
+    name TEXT PRIMARY KEY,
+    sql TEXT NOT NULL
+);
+'''
+
+# Statements used by the batch flushes, built once rather than per batch
+PATIENT_UPSERT_SQL = '''
+    INSERT INTO patients (client_id, first_name, last_name, gender, age, race, primary_lang, 
+                        insurance, phone, zipcode, first_visit_date, height, birthdate)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(client_id) DO UPDATE SET
+        first_name = excluded.first_name,
+        last_name = excluded.last_name,
+        gender = excluded.gender,
+        age = excluded.age,
+        race = excluded.race,
+        primary_lang = excluded.primary_lang,
+        insurance = excluded.insurance,
+        phone = excluded.phone,
+        zipcode = excluded.zipcode,
+        first_visit_date = COALESCE(patients.first_visit_date, excluded.first_visit_date),
+        height = COALESCE(patients.height, excluded.height),
+        birthdate = COALESCE(patients.birthdate, excluded.birthdate);
+'''
+
+GOALS_UPSERT_SQL = f'''
+    INSERT INTO patients_goals (client_id, visit_date, {", ".join(goals_mapping.values())})
+    VALUES (?, ?, {", ".join(["?" for _ in goals_mapping])})
+    ON CONFLICT(client_id, visit_date) DO UPDATE SET
+    {", ".join([f"{goal} = excluded.{goal}" for goal in goals_mapping.values()])};
+'''
+
+# patient_visits has no unique key on (client_id, visit_date), since the app records several visits on
+# one day, so a visit row is only inserted when no row for its date existed before the batch started
+# (ids at or below the batch's starting MAX(id)). The last parameter is that id.
+VISIT_INSERT_SQL = '''
+    INSERT INTO patient_visits (
+        client_id, visit_date, event_type, referral_source, follow_up,
+        hra, edu, case_management,
+        systolic, diastolic, cholesterol, fasting, glucose, height, weight, bmi, a1c,
+        acquired_by, visit_time
+    )
+    SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, '12:00'
+    WHERE NOT EXISTS (
+        SELECT 1 FROM patient_visits WHERE client_id = ?1 AND visit_date = ?2 AND id <= ?19
+    )
+'''
+
+VISIT_UPDATE_TABLE_SQL = '''
+    CREATE TEMP TABLE IF NOT EXISTS tmp_visit_updates (
+        event_type TEXT,
+        referral_source TEXT,
+        follow_up TEXT,
+        hra TEXT,
+        edu TEXT,
+        case_management TEXT,
+        systolic INTEGER,
+        diastolic INTEGER,
+        cholesterol INTEGER,
+        fasting TEXT,
+        glucose INTEGER,
+        height FLOAT,
+        weight FLOAT,
+        bmi FLOAT,
+        a1c FLOAT,
+        acquired_by TEXT,
+        client_id TEXT,
+        visit_date TEXT,
+        PRIMARY KEY (client_id, visit_date)
+    )
+'''
+
+# Takes the same rows as VISIT_INSERT_SQL and stages the ones whose date was already stored
+VISIT_UPDATE_STAGE_SQL = '''
+    INSERT INTO tmp_visit_updates (
+        client_id, visit_date, event_type, referral_source, follow_up, hra, edu, case_management,
+        systolic, diastolic, cholesterol, fasting, glucose, height, weight, bmi, a1c,
+        acquired_by
+    )
+    SELECT ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?
+    WHERE EXISTS (
+        SELECT 1 FROM patient_visits WHERE client_id = ?1 AND visit_date = ?2 AND id <= ?19
+    )
+    ON CONFLICT(client_id, visit_date) DO UPDATE SET
+        event_type = COALESCE(excluded.event_type, event_type),
+        referral_source = COALESCE(excluded.referral_source, referral_source),
+        follow_up = COALESCE(excluded.follow_up, follow_up),
+        hra = COALESCE(excluded.hra, hra),
+        edu = COALESCE(excluded.edu, edu),
+        case_management = COALESCE(excluded.case_management, case_management),
+        systolic = COALESCE(excluded.systolic, systolic),
+        diastolic = COALESCE(excluded.diastolic, diastolic),
+        cholesterol = COALESCE(excluded.cholesterol, cholesterol),
+        fasting = COALESCE(excluded.fasting, fasting),
+        glucose = COALESCE(excluded.glucose, glucose),
+        height = COALESCE(excluded.height, height),
+        weight = COALESCE(excluded.weight, weight),
+        bmi = COALESCE(excluded.bmi, bmi),
+        a1c = COALESCE(excluded.a1c, a1c),
+        acquired_by = COALESCE(excluded.acquired_by, acquired_by)
+'''
+
+# Visits whose staged values are all NULL or equal to the stored ones are left alone, so re-importing an
+# unchanged sheet doesn't rewrite their pages
+VISIT_UPDATE_APPLY_SQL = '''
+    UPDATE patient_visits
+    SET event_type = COALESCE((SELECT t.event_type FROM tmp_visit_updates t WHERE t.client_id = patient_visits.client_id AND t.visit_date = patient_visits.visit_date), event_type),
+        referral_source = COALESCE((SELECT t.referral_source FROM tmp_visit_updates t WHERE t.client_id = patient_visits.client_id AND t.visit_date = patient_visits.visit_date), referral_source),
+        follow_up = COALESCE((SELECT t.follow_up FROM tmp_visit_updates t WHERE t.client_id = patient_visits.client_id AND t.visit_date = patient_visits.visit_date), follow_up),
+        hra = COALESCE((SELECT t.hra FROM tmp_visit_updates t WHERE t.client_id = patient_visits.client_id AND t.visit_date = patient_visits.visit_date), hra),
+        edu = COALESCE((SELECT t.edu FROM tmp_visit_updates t WHERE t.client_id = patient_visits.client_id AND t.visit_date = patient_visits.visit_date), edu),
+        case_management = COALESCE((SELECT t.case_management FROM tmp_visit_updates t WHERE t.client_id = patient_visits.client_id AND t.visit_date = patient_visits.visit_date), case_management),
+        systolic = COALESCE((SELECT t.systolic FROM tmp_visit_updates t WHERE t.client_id = patient_visits.client_id AND t.visit_date = patient_visits.visit_date), systolic),
+        diastolic = COALESCE((SELECT t.diastolic FROM tmp_visit_updates t WHERE t.client_id = patient_visits.client_id AND t.visit_date = patient_visits.visit_date), diastolic),
+        cholesterol = COALESCE((SELECT t.cholesterol FROM tmp_visit_updates t WHERE t.client_id = patient_visits.client_id AND t.visit_date = patient_visits.visit_date), cholesterol),
+        fasting = COALESCE((SELECT t.fasting FROM tmp_visit_updates t WHERE t.client_id = patient_visits.client_id AND t.visit_date = patient_visits.visit_date), fasting),
+        glucose = COALESCE((SELECT t.glucose FROM tmp_visit_updates t WHERE t.client_id = patient_visits.client_id AND t.visit_date = patient_visits.visit_date), glucose),
+        height = COALESCE((SELECT t.height FROM tmp_visit_updates t WHERE t.client_id = patient_visits.client_id AND t.visit_date = patient_visits.visit_date), height),
+        weight = COALESCE((SELECT t.weight FROM tmp_visit_updates t WHERE t.client_id = patient_visits.client_id AND t.visit_date = patient_visits.visit_date), weight),
+        bmi = COALESCE((SELECT t.bmi FROM tmp_visit_updates t WHERE t.client_id = patient_visits.client_id AND t.visit_date = patient_visits.visit_date), bmi),
+        a1c = COALESCE((SELECT t.a1c FROM tmp_visit_updates t WHERE t.client_id = patient_visits.client_id AND t.visit_date = patient_visits.visit_date), a1c),
+        acquired_by = COALESCE((SELECT t.acquired_by FROM tmp_visit_updates t WHERE t.client_id = patient_visits.client_id AND t.visit_date = patient_visits.visit_date), acquired_by)
+    WHERE (client_id, visit_date) IN (SELECT client_id, visit_date FROM tmp_visit_updates)
+      AND EXISTS (
+          SELECT 1 FROM tmp_visit_updates t
+          WHERE t.client_id = patient_visits.client_id AND t.visit_date = patient_visits.visit_date
+            AND ((t.event_type IS NOT NULL AND t.event_type IS NOT patient_visits.event_type)
+                 OR (t.referral_source IS NOT NULL AND t.referral_source IS NOT patient_visits.referral_source)
+                 OR (t.follow_up IS NOT NULL AND t.follow_up IS NOT patient_visits.follow_up)
+                 OR (t.hra IS NOT NULL AND t.hra IS NOT patient_visits.hra)
+                 OR (t.edu IS NOT NULL AND t.edu IS NOT patient_visits.edu)
+                 OR (t.case_management IS NOT NULL AND t.case_management IS NOT patient_visits.case_management)
+                 OR (t.systolic IS NOT NULL AND t.systolic IS NOT patient_visits.systolic)
+                 OR (t.diastolic IS NOT NULL AND t.diastolic IS NOT patient_visits.diastolic)
+                 OR (t.cholesterol IS NOT NULL AND t.cholesterol IS NOT patient_visits.cholesterol)
+                 OR (t.fasting IS NOT NULL AND t.fasting IS NOT patient_visits.fasting)
+                 OR (t.glucose IS NOT NULL AND t.glucose IS NOT patient_visits.glucose)
+                 OR (t.height IS NOT NULL AND t.height IS NOT patient_visits.height)
+                 OR (t.weight IS NOT NULL AND t.weight IS NOT patient_visits.weight)
+                 OR (t.bmi IS NOT NULL AND t.bmi IS NOT patient_visits.bmi)
+                 OR (t.a1c IS NOT NULL AND t.a1c IS NOT patient_visits.a1c)
+                 OR (t.acquired_by IS NOT NULL AND t.acquired_by IS NOT patient_visits.acquired_by))
+      )
+'''
+
+# The record columns that make up a patient row and a goals row, in statement order
+patient_fields = ["client_id", "first_name", "last_name", "gender", "age", "race", "primary_lang",
+                  "insurance", "phone", "zipcode", "first_screen_date", "height", "birthdate"]
+goals_fields = ["client_id", "visit_date", *goals_mapping.values()]
+
+
+def extract_birthdates(client_ids):
+    """Read the MM/DD/YY birthdate from the last six digits of each client ID of at least 8 characters, else None"""
+    birthdate_part = client_ids.str[-6:]
+    birthdates = birthdate_part.str[0:2] + "/" + birthdate_part.str[2:4] + "/" + birthdate_part.str[4:6]
+    has_birthdate = (client_ids.str.len().ge(8) & birthdate_part.str.isdigit()).fillna(False).astype(bool)
+    return birthdates.astype(object).where(has_birthdate, None)
+
+
+# Map original column names to our DB field names
+column_mapping = {
+    "CLIENT ID": "client_id",
+    "FIRST NAME": "first_name",
+    "LAST NAME": "last_name",
+    "MALE/ FEMALE": "gender",
+    "AGE": "age",
+    "RACE": "race",
+    "Primary Language": "primary_lang",
+    "Insurance": "insurance",
+    "PHONE": "phone",
+    "ZIPCODE": "zipcode",
+    "EVENT TYPE": "event_type",
+    "How did you find program": "referral_source",
+    "First Screen Date": "first_screen_date",
+    "Follow-Up": "follow_up",
+    "DATE": "visit_date",
+    "AQUIRED BY": "acquired_by",
+    "HRA": "hra",
+    "EDU": "edu",
+    "Case Management": "case_management"
+}
 
-execute_with_retry(cursor, "SELECT client_id, birthdate FROM patients WHERE birthdate IS NOT NULL")
-existing_birthdates = {row["client_id"]: row["birthdate"] for row in cursor.fetchall()}
-logging.info(f"Loaded {len(existing_birthdates)} existing birthdates from database")
+old_health_metrics = {
+    "SYSTOLIC": "systolic",
+    "DIASTOLIC": "diastolic",
+    "Cholesterol": "cholesterol",
+    "FASTING": "fasting",
+    "GLUCOSE": "glucose",
+    "HEIGHT (in)": "height",
+    "WEIGHT": "weight",
+    "BMI": "bmi",
+    "A1C": "a1c"
+}
 
-birthdate_batch = []
+new_health_metrics = {
+    "NEW SYSTOLIC": "systolic",
+    "NEW DIASTOLIC": "diastolic",
+    "NEW CHOLESTEROL": "cholesterol",
+    "FASTING.1": "fasting",
+    "NEW GLUCOSE": "glucose",
+    "NEW WEIGHT": "weight",
+    "NEW BMI": "bmi",
+    "A1C.1": "a1c"
+}
 
+def normalize_header(name):
+    """Collapse runs of whitespace in a sheet header, which the source workbooks use inconsistently"""
+    return " ".join(str(name).split())
 
-def process_birthdate(client_id):
-    global birthdate_batch
-    if client_id in existing_birthdates:
-        return
-    birthdate = extract_birthdate(client_id)
-    if birthdate:
-        birthdate_batch.append((birthdate, client_id))
-        existing_birthdates[client_id] = birthdate
-        if len(birthdate_batch) >= BIRTHDATE_BATCH_SIZE:
-            flush_birthdate_batch()
 
+# Only the mapped columns are loaded; headers are compared after normalize_header
+source_columns = set(column_mapping) | set(old_health_metrics) | set(new_health_metrics) | set(goals_mapping)
+string_source_columns = {"CLIENT ID", "PHONE", "ZIPCODE", "MALE/ FEMALE", "Follow-Up", "FASTING"}
 
-def flush_birthdate_batch():
-    global birthdate_batch
-    if not birthdate_batch:
-        return
+# python-calamine is a compiled reader that is much faster than openpyxl; use it when installed.
+# Otherwise pandas picks openpyxl, which it already opens in read-only (streaming) mode.
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = "calamine"
+except ImportError:
+    EXCEL_ENGINE = None
+
+
+def load_client_list(excel_file):
+    """Read a workbook's CLIENT LIST sheet.
+
+    Returns the cleaned records, the first screen and current visit rows, and a mask of which
+    current visit rows should be written.
+    """
+    # Read and process Excel file
+    xls = pd.ExcelFile(excel_file, engine=EXCEL_ENGINE)
+    use_column = lambda name: normalize_header(name) in source_columns
+    # Identifier-like and text columns are read as nullable strings, so numeric cells never pass
+    # through float (which is what produced the trailing ".0") and blanks stay NA instead of "nan".
+    # dtype needs the raw, unnormalized headers.
+    header = pd.read_excel(xls, sheet_name="CLIENT LIST", usecols=use_column, nrows=0).columns
+    string_columns = {name: "string" for name in header
+                      if normalize_header(name) in string_source_columns}
+    client_list_df = pd.read_excel(xls, sheet_name="CLIENT LIST", usecols=use_column, dtype=string_columns)
+    client_list_df.columns = [normalize_header(name) for name in client_list_df.columns]
+
+    # Process goals: a cell marked "X" means the goal was set. All goal columns are
+    # built first and attached in a single concat to avoid repeated frame consolidation.
+    goal_columns = {}
+    for goal, col_name in goals_mapping.items():
+        if goal in client_list_df.columns:
+            marked = client_list_df[goal].astype("string").str.strip().str.upper().eq("X")
+            goal_columns[col_name] = marked.fillna(False).astype("int8")
+        else:
+            goal_columns[col_name] = 0
+    client_list_df = pd.concat([client_list_df, pd.DataFrame(goal_columns, index=client_list_df.index)], axis=1)
+
+    # Clean up and transform the dataframe
+    all_columns = list(column_mapping.keys()) + list(old_health_metrics.keys()) + list(
+        new_health_metrics.keys()) + list(goals_mapping.values())
+    client_list_df = client_list_df[all_columns].rename(columns={**column_mapping, **old_health_metrics})
+    client_list_df = client_list_df.dropna(subset=["client_id"])
+    client_list_df["birthdate"] = extract_birthdates(client_list_df["client_id"])
+    client_list_df["gender"] = client_list_df["gender"].str.strip().replace({"M": "Male", "F": "Female"})
+
+    # Convert numeric fields in one pass per group. Nullable dtypes keep missing values as
+    # pd.NA, which the records conversion below turns into None. The integer fields are stored as
+    # entered, not rounded or range-checked: the INTEGER columns keep whole numbers as integers and
+    # a fractional or very large value is stored unchanged.
+    integer_fields = ["age", "systolic", "diastolic", "cholesterol", "glucose"]
+    float_fields = ["height", "weight", "bmi", "a1c"]
+    client_list_df[integer_fields] = client_list_df[integer_fields].apply(
+        pd.to_numeric, errors='coerce').astype("Float64")
+    client_list_df[float_fields] = client_list_df[float_fields].apply(
+        pd.to_numeric, errors='coerce').round(1).astype("Float64")
+
+    # Format dates as ISO text in one frame-level pass. Unparseable and blank dates become None, since
+    # the record loop tests these two columns for truthiness.
+    date_columns = ["visit_date", "first_screen_date"]
+    dates = client_list_df[date_columns].apply(
+        lambda column: pd.to_datetime(column, errors='coerce').dt.strftime('%Y-%m-%d'))
+    client_list_df[date_columns] = dates.astype(object).where(dates.notna(), None)
+
+    # A row with a First Screen Date but no DATE is a first visit, so it is dated on the first screen date
+    client_list_df["visit_date"] = client_list_df["visit_date"].fillna(client_list_df["first_screen_date"])
+
+    # The "NEW" health metrics belong to the current visit. They are converted column-wise, and on a
+    # first visit an empty NEW value falls back to the value entered in the regular field.
+    first_visit = client_list_df["visit_date"].eq(client_list_df["first_screen_date"])
+    new_metrics = {}
+    for source_col, col in new_health_metrics.items():
+        old_value = client_list_df[col]
+        if col == "fasting":
+            new_value = client_list_df[source_col]
+            new_value = new_value.where(new_value.notna() & new_value.fillna("").astype(bool) & new_value.ne("nan"))
+            has_old_value = old_value.notna() & old_value.ne("") & old_value.ne("nan")
+            new_metrics[col] = new_value.mask(first_visit & new_value.isna() & has_old_value, old_value)
+            continue
+        new_value = pd.to_numeric(client_list_df[source_col], errors='coerce')
+        new_value = new_value.mask(first_visit & new_value.isna() & old_value.notna(), old_value.astype("float64"))
+        if col in integer_fields:
+            # NEW integer metrics are truncated to whole numbers; a value that does not fit in 64 bits
+            # (including inf) is dropped to NULL instead of failing the whole workbook
+            new_value = new_value.where(new_value.abs() < 2 ** 63)
+            new_metrics[col] = np.trunc(new_value).astype("Int64")
+        else:
+            new_metrics[col] = new_value.round(1).astype("Float64")
+    new_metrics["height"] = client_list_df["height"]  # Height assumed to be the same as first visit
+
+    # First screen visits only carry the original health metrics (no event data), so their
+    # rows are laid out column-wise in INSERT order once instead of being assembled per record
+    first_screen_visits_df = pd.DataFrame({
+        "client_id": client_list_df["client_id"],
+        "visit_date": client_list_df["first_screen_date"],
+        **dict.fromkeys(["event_type", "referral_source", "follow_up", "hra", "edu", "case_management"]),
+        **{col: client_list_df[col] for col in ["systolic", "diastolic", "cholesterol", "fasting", "glucose",
+                                                "height", "weight", "bmi", "a1c"]},
+        "acquired_by": None
+    }, index=client_list_df.index)
+
+    # Current visits carry both the event data and the NEW health metrics, in the same INSERT order
+    current_visits_df = pd.DataFrame({
+        "client_id": client_list_df["client_id"],
+        "visit_date": client_list_df["visit_date"],
+        **{col: client_list_df[col] for col in ["event_type", "referral_source", "follow_up", "hra", "edu",
+                                                "case_management"]},
+        **{col: new_metrics[col] for col in ["systolic", "diastolic", "cholesterol", "fasting", "glucose",
+                                             "height", "weight", "bmi", "a1c"]},
+        "acquired_by": client_list_df["acquired_by"]
+    }, index=client_list_df.index)
+
+    # Only write a current visit if:
+    # 1. It's different from first_screen_date, OR
+    # 2. We have new health metrics (height is carried over from the first visit), OR
+    # 3. We have event data
+    has_new_metrics = current_visits_df[["systolic", "diastolic", "cholesterol", "fasting", "glucose",
+                                         "weight", "bmi", "a1c"]].notna().any(axis=1)
+    event_data = current_visits_df[["event_type", "referral_source", "follow_up", "hra", "edu", "case_management"]]
+    has_event_data = event_data.astype(object).where(event_data.notna(), None).astype(bool).any(axis=1)
+    write_current_visit = client_list_df["visit_date"].notna() & (
+        client_list_df["visit_date"].ne(client_list_df["first_screen_date"]) | has_new_metrics | has_event_data)
+
+    # Only the patient and goals columns are read from the records from here on, so the sheet's metric and
+    # event columns are dropped instead of being pickled back from a loader process with the visit frames
+    records_df = client_list_df[list(dict.fromkeys(patient_fields + goals_fields))]
+    return records_df, first_screen_visits_df, current_visits_df, write_current_visit
+
+
+def import_client_list(cursor, excel_file, loaded):
+    """Write one workbook's loaded rows in batches; the caller owns the surrounding transaction"""
+    records_df, first_screen_visits_df, current_visits_df, write_current_visit = loaded
+    total_records = len(records_df)
+    logging.info(f"Found {total_records} patient records in {excel_file}")
+
+    # The patient and goals rows are read straight off their columns in statement order. Goals are only
+    # written for records with a visit date.
+    patient_rows = records_df[patient_fields]
+    goals_rows = records_df[goals_fields]
+    has_goals = records_df["visit_date"].notna()
+
+    for start in range(0, total_records, BATCH_SIZE):
+        batch = slice(start, start + BATCH_SIZE)
+
+        # Patient and goals rows are passed to executemany as iterators rather than collected into lists.
+        # The file transaction is BEGIN IMMEDIATE, so the write lock is already held and execute_with_retry
+        # never has to replay a half-consumed iterator. Every batch is written in primary key order, which
+        # keeps the B-tree inserts local; the sorts are stable, so repeated keys keep their sheet order and
+        # the stored values are the same as in sheet order. The birthdate read from the client ID only fills a
+        # patient's birthdate while it is still empty.
+        patients = patient_rows.iloc[batch].sort_values("client_id", kind="stable")
+        execute_with_retry(cursor, PATIENT_UPSERT_SQL, patients.itertuples(index=False, name=None), is_many=True)
+
+        goals = goals_rows.iloc[batch]
+        goals = goals[has_goals.iloc[batch]].sort_values(["client_id", "visit_date"], kind="stable")
+        execute_with_retry(cursor, GOALS_UPSERT_SQL, goals.itertuples(index=False, name=None), is_many=True)
+
+        # Rows up to this id were stored before the batch. Only the first record of a date in the batch can
+        # insert it; any later record on that date updates the row, whether it was stored or is inserted just
+        # before, so every row counts as stored for it. Records are taken in sheet order (a first screen visit
+        # before the current visit of the same record), so the stored values are the same as writing one row
+        # at a time, whatever BATCH_SIZE is. The first screen visit only carries the original health metrics,
+        # no event data; the current visit carries the NEW health metrics and the event data.
+        execute_with_retry(cursor, "SELECT COALESCE(MAX(id), 0) FROM patient_visits")
+        stored_id = cursor.fetchone()[0]
+        first_screen_visits = first_screen_visits_df.iloc[batch]
+        # Both frames are cast to object first, so their all-None columns take no part in picking a dtype
+        visits = pd.concat([first_screen_visits[first_screen_visits["visit_date"].notna()].astype(object),
+                            current_visits_df.iloc[batch][write_current_visit.iloc[batch]].astype(object)])
+        visits = visits.sort_index(kind="stable")
+        seen = visits.duplicated(["client_id", "visit_date"])
+        visits = visits.assign(stored_id=np.where(seen, sys.maxsize, stored_id))
+        visits = visits.sort_values(["client_id", "visit_date"], kind="stable")
+        visit_rows = list(visits.itertuples(index=False, name=None))
+
+        # Insert the visits whose date is new, then stage the rest through a temp table so the whole batch is
+        # applied by one UPDATE. COALESCE keeps the stored value where the new one is NULL, both when merging
+        # repeated keys into the temp table and when applying it to patient_visits. First screen records carry
+        # None for the event fields, so those columns are left untouched. Both statements read visit_rows,
+        # which is why it is a list.
+        if visit_rows:
+            execute_with_retry(cursor, VISIT_INSERT_SQL, visit_rows, is_many=True)
+            if execute_with_retry(cursor, VISIT_UPDATE_STAGE_SQL, visit_rows, is_many=True).rowcount > 0:
+                execute_with_retry(cursor, VISIT_UPDATE_APPLY_SQL)
+                execute_with_retry(cursor, "DELETE FROM tmp_visit_updates")
+
+        logging.info(f"Processed {min(start + BATCH_SIZE, total_records)}/{total_records} records in {excel_file}")
+
+
+def drop_secondary_indexes(conn):
+    """Drop the indexes on the imported tables that the import never reads.
+
+    Primary keys and idx_pv_client_date stay, since the upserts and the visit lookups depend on them. The
+    CREATE statements are recorded in import_dropped_indexes in the same transaction as the drops, so the
+    indexes can be rebuilt even if the import is killed before it gets to do so.
+    """
+    cursor = conn.cursor()
+    execute_with_retry(cursor, "BEGIN IMMEDIATE")
     try:
-        execute_with_retry(cursor,
-                           "UPDATE patients SET birthdate = ? WHERE client_id = ?",
-                           birthdate_batch,
-                           is_many=True)
-        logging.info(f"Updated {len(birthdate_batch)} patient birthdates")
-        birthdate_batch = []
-    except Exception as e:
-        logging.error(f"Error updating birthdates: {str(e)}")
-
-conn.commit()
+        execute_with_retry(cursor, """
+            INSERT OR IGNORE INTO import_dropped_indexes (name, sql)
+            SELECT name, sql FROM sqlite_master
+            WHERE type = 'index' AND sql IS NOT NULL AND name != 'idx_pv_client_date'
+              AND tbl_name IN ('patients', 'patient_visits', 'patients_goals')
+        """)
+        execute_with_retry(cursor, "SELECT name FROM import_dropped_indexes")
+        names = [name for (name,) in cursor.fetchall()]
+        for name in names:
+            execute_with_retry(cursor, f'DROP INDEX IF EXISTS "{name}"')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    logging.info(f"Dropped {len(names)} secondary indexes for the import")
 
-file_count = len(EXCEL_FILES)
-for file_index, excel_file in enumerate(EXCEL_FILES):
-    logging.info(f"Processing file {file_index + 1}/{file_count}: {excel_file}")
-    print(f"Processing {excel_file}... ({file_index + 1}/{file_count})")
 
+def rebuild_secondary_indexes(conn):
+    """Recreate the indexes recorded in import_dropped_indexes, whether by this import or an interrupted one"""
+    cursor = conn.cursor()
+    execute_with_retry(cursor, "SELECT name, sql FROM import_dropped_indexes")
+    indexes = cursor.fetchall()
+    if not indexes:
+        return
+    execute_with_retry(cursor, "BEGIN IMMEDIATE")
     try:
-        # Begin transaction for this file
-        execute_with_retry(cursor, "BEGIN TRANSACTION")
-
-        # Read and process Excel file
-        xls = pd.ExcelFile(excel_file)
-        client_list_df = pd.read_excel(xls, sheet_name="CLIENT LIST")
-        client_list_df.columns = client_list_df.columns.str.replace(r'\s+', ' ', regex=True).str.strip()
-
-        # Map original column names to our DB field names
-        column_mapping = {
-            "CLIENT ID": "client_id",
-            "FIRST NAME": "first_name",
-            "LAST NAME": "last_name",
-            "MALE/ FEMALE": "gender",
-            "AGE": "age",
-            "RACE": "race",
-            "Primary Language": "primary_lang",
-            "Insurance": "insurance",
-            "PHONE": "phone",
-            "ZIPCODE": "zipcode",
-            "EVENT TYPE": "event_type",
-            "How did you find program": "referral_source",
-            "First Screen Date": "first_screen_date",
-            "Follow-Up": "follow_up",
-            "DATE": "visit_date",
-            "AQUIRED BY": "acquired_by",
-            "HRA": "hra",
-            "EDU": "edu",
-            "Case Management": "case_management"
-        }
-
-        old_health_metrics = {
-            "SYSTOLIC": "systolic",
-            "DIASTOLIC": "diastolic",
-            "Cholesterol": "cholesterol",
-            "FASTING": "fasting",
-            "GLUCOSE": "glucose",
-            "HEIGHT (in)": "height",
-            "WEIGHT": "weight",
-            "BMI": "bmi",
-            "A1C": "a1c"
-        }
-
-        new_health_metrics = {
-            "NEW SYSTOLIC": "systolic",
-            "NEW DIASTOLIC": "diastolic",
-            "NEW CHOLESTEROL": "cholesterol",
-            "FASTING.1": "fasting",
-            "NEW GLUCOSE": "glucose",
-            "NEW WEIGHT": "weight",
-            "NEW BMI": "bmi",
-            "A1C.1": "a1c"
-        }
-
-        # Process goals
-        for goal, col_name in goals_mapping.items():
-            if goal in client_list_df.columns:
-                client_list_df[col_name] = client_list_df[goal].apply(
-                    lambda x: 1 if str(x).strip().upper() == "X" else 0)
-            else:
-                client_list_df[col_name] = 0
-
-        # Clean up and transform the dataframe
-        all_columns = list(column_mapping.keys()) + list(old_health_metrics.keys()) + list(
-            new_health_metrics.keys()) + list(goals_mapping.values())
-        client_list_df = client_list_df[all_columns].rename(columns={**column_mapping, **old_health_metrics})
-        client_list_df = client_list_df.dropna(subset=["client_id"])
-        client_list_df["gender"] = client_list_df["gender"].str.strip().replace({"M": "Male", "F": "Female"})
-        client_list_df["follow_up"] = client_list_df["follow_up"].astype(str).replace({"nan": None, "NaN": None})
-        client_list_df["fasting"] = client_list_df["fasting"].astype(str).replace({"nan": None, "NaN": None})
-
-        # Convert numeric fields
-        integer_fields = ["age", "systolic", "diastolic", "cholesterol", "glucose"]
-        float_fields = ["height", "weight", "bmi", "a1c"]
-        for field in integer_fields:
-            client_list_df[field] = pd.to_numeric(client_list_df[field], errors='coerce').where(
-                pd.notna(client_list_df[field]), None)
-        for field in float_fields:
-            client_list_df[field] = pd.to_numeric(client_list_df[field], errors='coerce').round(1).where(
-                pd.notna(client_list_df[field]), None)
-
-        # Clean string fields
-        client_list_df["phone"] = client_list_df["phone"].astype(str).str.replace(r'\.0$', '', regex=True).replace(
-            {"nan": None, "NaN": None})
-        client_list_df["zipcode"] = client_list_df["zipcode"].astype(str).str.replace(r'\.0$', '', regex=True).replace(
-            {"nan": None, "NaN": None})
-
-        # Format dates
-        for date_col in ["visit_date", "first_screen_date"]:
-            client_list_df[date_col] = pd.to_datetime(client_list_df[date_col], errors='coerce').dt.strftime('%Y-%m-%d')
-            client_list_df[date_col] = client_list_df[date_col].where(pd.notna(client_list_df[date_col]), None)
-
-        # Convert to dictionary records
-        patient_records = client_list_df.where(pd.notna(client_list_df), None).to_dict(orient="records")
-        total_records = len(patient_records)
-        logging.info(f"Found {total_records} patient records in {excel_file}")
-
-        # Initialize batch containers
-        patient_batch = []
-        patient_visit_first_screen_batch = []
-        patient_visit_current_batch = []
-        goals_batch = []
-
-        # Process each patient record
-        for i, row in enumerate(patient_records):
-            client_id = row["client_id"]
-            process_birthdate(client_id)
-
-            # Handle case where Date is empty but First Screen Date exists
-            # This indicates a first visit where the same values may be entered in both regular and "NEW" fields
-            if row["first_screen_date"] and (row["visit_date"] is None or pd.isna(row["visit_date"])):
-                # If this is a first visit (no visit_date), use first_screen_date as the visit_date
-                row["visit_date"] = row["first_screen_date"]
-
-            # Update birthdate if needed
-            if client_id not in existing_birthdates:
-                birthdate = extract_birthdate(client_id)
-                if birthdate:
-                    execute_with_retry(cursor, "UPDATE patients SET birthdate = ? WHERE client_id = ?",
-                                       (birthdate, client_id))
-                    existing_birthdates[client_id] = birthdate
-
-            # Add patient data to batch
-            patient_data = tuple(row.get(col) for col in ["client_id", "first_name", "last_name", "gender", "age",
-                                                          "race", "primary_lang", "insurance", "phone", "zipcode",
-                                                          "first_screen_date"]) + (row.get("height"),)
-            patient_batch.append(patient_data)
-
-            # Add goals data to batch if visit_date exists
-            if row["visit_date"]:
-                goals_data = (row["client_id"], row["visit_date"]) + tuple(
-                    row.get(col) for col in goals_mapping.values())
-                goals_batch.append(goals_data)
-
-            # 1. CREATE/UPDATE RECORD FOR FIRST SCREEN DATE (with original health metrics ONLY)
-            if row["first_screen_date"]:
-                # For first screen date, we only include health metrics - no event data
-                first_screen_visit_data = [
-                    client_id, row["first_screen_date"],
-                    None, None, None,  # event_type, referral_source, follow_up set to None
-                    None, None, None,  # hra, edu, case_management set to None
-                    row.get("systolic"), row.get("diastolic"), row.get("cholesterol"),
-                    row.get("fasting"), row.get("glucose"), row.get("height"), row.get("weight"),
-                    row.get("bmi"), row.get("a1c"), None  # acquired_by set to None
-                ]
-                patient_visit_first_screen_batch.append(tuple(first_screen_visit_data))
-
-            # 2. CREATE RECORD FOR CURRENT VISIT DATE (with NEW health metrics AND event data)
-            if row["visit_date"]:
-                # Extract new health metrics from the row
-                has_new_metrics = False
-                new_systolic = pd.to_numeric(row.get("NEW SYSTOLIC"), errors='coerce')
-                new_diastolic = pd.to_numeric(row.get("NEW DIASTOLIC"), errors='coerce')
-                new_cholesterol = pd.to_numeric(row.get("NEW CHOLESTEROL"), errors='coerce')
-                new_fasting = row.get("FASTING.1")
-                new_glucose = pd.to_numeric(row.get("NEW GLUCOSE"), errors='coerce')
-                new_weight = pd.to_numeric(row.get("NEW WEIGHT"), errors='coerce')
-                new_bmi = pd.to_numeric(row.get("NEW BMI"), errors='coerce')
-                new_a1c = pd.to_numeric(row.get("A1C.1"), errors='coerce')
-
-                # For first visits where visit_date equals first_screen_date:
-                # If NEW fields are empty but regular fields have data, use regular field values
-                first_visit = row["visit_date"] == row["first_screen_date"]
-
-                if first_visit:
-                    if pd.isna(new_systolic) and not pd.isna(row.get("systolic")):
-                        new_systolic = row.get("systolic")
-                    if pd.isna(new_diastolic) and not pd.isna(row.get("diastolic")):
-                        new_diastolic = row.get("diastolic")
-                    if pd.isna(new_cholesterol) and not pd.isna(row.get("cholesterol")):
-                        new_cholesterol = row.get("cholesterol")
-                    if (not new_fasting or new_fasting == "nan") and row.get("fasting") and row.get("fasting") != "nan":
-                        new_fasting = row.get("fasting")
-                    if pd.isna(new_glucose) and not pd.isna(row.get("glucose")):
-                        new_glucose = row.get("glucose")
-                    if pd.isna(new_weight) and not pd.isna(row.get("weight")):
-                        new_weight = row.get("weight")
-                    if pd.isna(new_bmi) and not pd.isna(row.get("bmi")):
-                        new_bmi = row.get("bmi")
-                    if pd.isna(new_a1c) and not pd.isna(row.get("a1c")):
-                        new_a1c = row.get("a1c")
-
-                # Check if we have any new metrics
-                if (pd.notna(new_systolic) or pd.notna(new_diastolic) or pd.notna(new_cholesterol) or
-                        (new_fasting and new_fasting != "nan") or pd.notna(new_glucose) or
-                        pd.notna(new_weight) or pd.notna(new_bmi) or pd.notna(new_a1c)):
-                    has_new_metrics = True
-
-                # Format numeric values
-                if pd.notna(new_systolic): new_systolic = int(new_systolic)
-                if pd.notna(new_diastolic): new_diastolic = int(new_diastolic)
-                if pd.notna(new_cholesterol): new_cholesterol = int(new_cholesterol)
-                if pd.notna(new_glucose): new_glucose = int(new_glucose)
-                if pd.notna(new_weight): new_weight = round(float(new_weight), 1)
-                if pd.notna(new_bmi): new_bmi = round(float(new_bmi), 1)
-                if pd.notna(new_a1c): new_a1c = round(float(new_a1c), 1)
-
-                # For current visit date, include BOTH event data AND new health metrics
-                current_visit_data = [
-                    client_id, row["visit_date"],
-                    row.get("event_type"), row.get("referral_source"), row.get("follow_up"),
-                    row.get("hra"), row.get("edu"), row.get("case_management"),
-                    new_systolic if pd.notna(new_systolic) else None,
-                    new_diastolic if pd.notna(new_diastolic) else None,
-                    new_cholesterol if pd.notna(new_cholesterol) else None,
-                    new_fasting if new_fasting and new_fasting != "nan" else None,
-                    new_glucose if pd.notna(new_glucose) else None,
-                    row.get("height"),  # Height assumed to be the same as first visit
-                    new_weight if pd.notna(new_weight) else None,
-                    new_bmi if pd.notna(new_bmi) else None,
-                    new_a1c if pd.notna(new_a1c) else None,
-                    row.get("acquired_by")
-                ]
-
-                # Only add to batch if:
-                # 1. It's different from first_screen_date, OR
-                # 2. We have new health metrics, OR
-                # 3. We have event data
-                has_event_data = any(current_visit_data[2:8])  # Check if any event data fields are non-None
-
-                if row["visit_date"] != row["first_screen_date"] or has_new_metrics or has_event_data:
-                    patient_visit_current_batch.append(tuple(current_visit_data))
-
-            # Process batches when they reach the batch size or at the end of records
-            if len(patient_batch) >= BATCH_SIZE or i == total_records - 1:
-                if patient_batch:
-                    # Insert/update patients
-                    execute_with_retry(cursor, '''
-                        INSERT INTO patients (client_id, first_name, last_name, gender, age, race, primary_lang, 
-                                            insurance, phone, zipcode, first_visit_date, height)
-                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        ON CONFLICT(client_id) DO UPDATE SET
-                            first_name = excluded.first_name,
-                            last_name = excluded.last_name,
-                            gender = excluded.gender,
-                            age = excluded.age,
-                            race = excluded.race,
-                            primary_lang = excluded.primary_lang,
-                            insurance = excluded.insurance,
-                            phone = excluded.phone,
-                            zipcode = excluded.zipcode,
-                            first_visit_date = COALESCE(patients.first_visit_date, excluded.first_visit_date),
-                            height = COALESCE(patients.height, excluded.height);
-                    ''', patient_batch, is_many=True)
-                    patient_batch = []
-
-                if goals_batch:
-                    # Insert/update goals
-                    execute_with_retry(cursor, f'''
-                        INSERT INTO patients_goals (client_id, visit_date, {", ".join(goals_mapping.values())})
-                        VALUES (?, ?, {", ".join(["?" for _ in goals_mapping])})
-                        ON CONFLICT(client_id, visit_date) DO UPDATE SET
-                        {", ".join([f"{goal} = excluded.{goal}" for goal in goals_mapping.values()])};
-                    ''', goals_batch, is_many=True)
-                    goals_batch = []
-
-                # Process first screen visit records in batch
-                if patient_visit_first_screen_batch:
-                    # First, find which of these records already exist
-                    client_visit_pairs = [(record[0], record[1]) for record in patient_visit_first_screen_batch]
-                    existing_visits = {}
-
-                    # Check in smaller chunks to avoid too many parameters
-                    for chunk_start in range(0, len(client_visit_pairs), 100):
-                        chunk = client_visit_pairs[chunk_start:chunk_start + 100]
-                        placeholders = ", ".join(["(?, ?)"] * len(chunk))
-                        params = [param for pair in chunk for param in pair]
-
-                        query = f'''
-                            SELECT client_id, visit_date 
-                            FROM patient_visits 
-                            WHERE (client_id, visit_date) IN ({placeholders})
-                        '''
-                        execute_with_retry(cursor, query, params)
-                        for row in cursor.fetchall():
-                            existing_visits[(row["client_id"], row["visit_date"])] = True
-
-                    # Separate records into new inserts and updates
-                    records_to_insert = []
-
-                    for record in patient_visit_first_screen_batch:
-                        client_id, visit_date = record[0], record[1]
-                        if (client_id, visit_date) not in existing_visits:
-                            records_to_insert.append(record)
-                        else:
-                            # For existing records, update only health metrics fields
-                            health_fields = ["systolic", "diastolic", "cholesterol", "fasting",
-                                             "glucose", "height", "weight", "bmi", "a1c"]
-                            update_fields = []
-                            update_values = []
-
-                            for i, field in enumerate(health_fields):
-                                if record[i + 8] is not None:  # +8 to skip the event data fields
-                                    update_fields.append(f"{field} = ?")
-                                    update_values.append(record[i + 8])
-
-                            if update_fields:
-                                update_values.extend([client_id, visit_date])
-                                execute_with_retry(cursor, f'''
-                                    UPDATE patient_visits 
-                                    SET {', '.join(update_fields)} 
-                                    WHERE client_id = ? AND visit_date = ?
-                                ''', update_values)
-
-                    # Batch insert new records
-                    if records_to_insert:
-                        execute_with_retry(cursor, '''
-                            INSERT INTO patient_visits (
-                                client_id, visit_date, event_type, referral_source, follow_up,
-                                hra, edu, case_management,
-                                systolic, diastolic, cholesterol, fasting, glucose, height, weight, bmi, a1c,
-                                acquired_by, visit_time
-                            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, '12:00')
-                        ''', records_to_insert, is_many=True)
-
-                    patient_visit_first_screen_batch = []
-
-                # Process current visit records in batch
-                if patient_visit_current_batch:
-                    # First, find which of these records already exist
-                    client_visit_pairs = [(record[0], record[1]) for record in patient_visit_current_batch]
-                    existing_visits = {}
-
-                    # Check in smaller chunks to avoid too many parameters
-                    for chunk_start in range(0, len(client_visit_pairs), 100):
-                        chunk = client_visit_pairs[chunk_start:chunk_start + 100]
-                        placeholders = ", ".join(["(?, ?)"] * len(chunk))
-                        params = [param for pair in chunk for param in pair]
-
-                        query = f'''
-                            SELECT client_id, visit_date 
-                            FROM patient_visits 
-                            WHERE (client_id, visit_date) IN ({placeholders})
-                        '''
-                        execute_with_retry(cursor, query, params)
-                        for row in cursor.fetchall():
-                            existing_visits[(row["client_id"], row["visit_date"])] = True
-
-                    # Separate records into new inserts and updates
-                    records_to_insert = []
-
-                    for record in patient_visit_current_batch:
-                        client_id, visit_date = record[0], record[1]
-                        if (client_id, visit_date) not in existing_visits:
-                            records_to_insert.append(record)
-                        else:
-                            # For existing records, update all non-null fields
-                            field_names = ["event_type", "referral_source", "follow_up", "hra", "edu",
-                                           "case_management", "systolic", "diastolic", "cholesterol",
-                                           "fasting", "glucose", "height", "weight", "bmi", "a1c", "acquired_by"]
-                            update_fields = []
-                            update_values = []
-
-                            for i, field in enumerate(field_names):
-                                # i+2 because first two elements in record are client_id and visit_date
-                                if record[i + 2] is not None:
-                                    update_fields.append(f"{field} = ?")
-                                    update_values.append(record[i + 2])
-
-                            if update_fields:
-                                update_values.extend([client_id, visit_date])
-                                execute_with_retry(cursor, f'''
-                                    UPDATE patient_visits 
-                                    SET {', '.join(update_fields)} 
-                                    WHERE client_id = ? AND visit_date = ?
-                                ''', update_values)
-
-                    # Batch insert new records
-                    if records_to_insert:
-                        execute_with_retry(cursor, '''
-                            INSERT INTO patient_visits (
-                                client_id, visit_date, event_type, referral_source, follow_up,
-                                hra, edu, case_management,
-                                systolic, diastolic, cholesterol, fasting, glucose, height, weight, bmi, a1c,
-                                acquired_by, visit_time
-                            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, '12:00')
-                        ''', records_to_insert, is_many=True)
-
-                    patient_visit_current_batch = []
-
-            # Periodically commit to avoid too large transactions
-            if i % (BATCH_SIZE * 10) == 0 and i > 0:
-                conn.commit()
-                logging.info(f"Processed {i}/{total_records} records in {excel_file}")
-
-        flush_birthdate_batch()
+        for name, sql in indexes:
+            execute_with_retry(cursor, "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = ?", (name,))
+            if not cursor.fetchone():
+                execute_with_retry(cursor, sql)
+        execute_with_retry(cursor, "DELETE FROM import_dropped_indexes")
         conn.commit()
-        logging.info(f"Successfully processed file: {excel_file}")
-
-    except Exception as e:
-        # Roll back the transaction on error
+    except Exception:
         conn.rollback()
-        error_msg = f"Error processing file {excel_file}: {str(e)}"
-        logging.error(error_msg)
-        print(f"{error_msg}")
-        # Continue with the next file instead of aborting the entire process
-        continue
-
-conn.close()
+        raise
+    logging.info(f"Rebuilt {len(indexes)} secondary indexes")
 
 
 def link_goals_to_visits(conn):
@@ -752,12 +778,118 @@ def link_goals_to_visits(conn):
         raise
 
 
-try:
-    conn = sqlite3.connect(DB_FILE)
-    total_goals, unlinked_goals = link_goals_to_visits(conn)
-    print(f"Linked goals to visits. Total goals: {total_goals}, Unlinked: {unlinked_goals}")
-finally:
-    conn.close()
-
-print("✅ Successfully updated patient records database with proper separation of event data and health metrics.")
-logging.info("Patient record import completed successfully")
\ No newline at end of file
+def import_files(conn, excel_files):
+    """Import each workbook in its own transaction, rolling back and moving on when a file fails"""
+    cursor = conn.cursor()
+
+    # Reading and cleaning each workbook is CPU-bound and independent of the others, so the files are
+    # loaded in worker processes while all database writes stay on this connection. Only as many loads as
+    # there are workers are queued ahead of the writer, so at most that many loaded workbooks are held in
+    # memory however many files are imported.
+    load_executor = None
+    pending_loads = {}
+    load_workers = min(len(excel_files), os.cpu_count() or 1)
+    if len(excel_files) > 1:
+        load_executor = ProcessPoolExecutor(max_workers=load_workers)
+        pending_loads = {index: load_executor.submit(load_client_list, excel_files[index])
+                         for index in range(load_workers)}
+
+    file_count = len(excel_files)
+    for file_index, excel_file in enumerate(excel_files):
+        logging.info(f"Processing file {file_index + 1}/{file_count}: {excel_file}")
+        print(f"Processing {excel_file}... ({file_index + 1}/{file_count})")
+
+        try:
+            if load_executor:
+                pending_load = pending_loads.pop(file_index)
+                next_index = file_index + load_workers
+                if next_index < file_count:
+                    pending_loads[next_index] = load_executor.submit(load_client_list, excel_files[next_index])
+                loaded = pending_load.result()
+            else:
+                loaded = load_client_list(excel_file)
+
+            # Begin transaction for this file only once it is loaded, so the app's writers aren't locked out
+            # while the workbook is parsed; the write lock is then taken up front
+            execute_with_retry(cursor, "BEGIN IMMEDIATE")
+            import_client_list(cursor, excel_file, loaded)
+            conn.commit()
+            logging.info(f"Successfully processed file: {excel_file}")
+
+        except Exception as e:
+            # Roll back the transaction on error
+            conn.rollback()
+            error_msg = f"Error processing file {excel_file}: {str(e)}"
+            logging.error(error_msg)
+            print(f"{error_msg}")
+            # Continue with the next file instead of aborting the entire process
+            continue
+
+    if load_executor:
+        load_executor.shutdown()
+
+
+def run(excel_files, db_file, fast_import=False):
+    """Import the CLIENT LIST sheet of each Excel workbook into the SQLite database at db_file.
+
+    With fast_import, secondary indexes are dropped for the import and rebuilt once at the end, which is
+    quicker for large loads than updating them row by row.
+    """
+    conn = sqlite3.connect(db_file)
+    cursor = conn.cursor()
+
+    execute_with_retry(cursor, SCHEMA_SQL, is_script=True)
+    # Created outside the per-file transactions so a rolled back file cannot take it with it; every
+    # visit flush stages into it and empties it again
+    execute_with_retry(cursor, VISIT_UPDATE_TABLE_SQL)
+
+    # Run the database migration before processing any files
+    print("\nStarting database migration to add visit_time and link goals to visits...")
+    migrate_database(db_file)
+    print("Migration completed. Beginning to process files...")
+
+    # Indexes left dropped by an import that was killed before rebuilding them are restored first
+    rebuild_secondary_indexes(conn)
+    if fast_import:
+        drop_secondary_indexes(conn)
+
+    # The import, the linking and the maintenance below all run on this connection, with its bulk-load PRAGMAs
+    try:
+        try:
+            import_files(conn, excel_files)
+            total_goals, unlinked_goals = link_goals_to_visits(conn)
+            print(f"Linked goals to visits. Total goals: {total_goals}, Unlinked: {unlinked_goals}")
+            # The one foreign key check for the whole import
+            orphaned_rows = conn.execute("PRAGMA foreign_key_check").fetchall()
+            if orphaned_rows:
+                logging.warning(f"Warning: {len(orphaned_rows)} visit or goal rows reference a client_id missing from patients")
+        finally:
+            # Dropped indexes are rebuilt however the import ends, since the app never recreates them itself;
+            # a file interrupted mid-import is rolled back first so the rebuild isn't lost with it
+            if conn.in_transaction:
+                conn.rollback()
+            rebuild_secondary_indexes(conn)
+        # Refresh planner statistics so the indexes are used on the freshly loaded tables
+        conn.execute("ANALYZE")
+        # Fold the import's WAL back into the database file and truncate it, rather than leaving a WAL as
+        # large as everything just written for the app's first checkpoint. The checkpoint overwrites pages
+        # of the database file, so it runs with the app's synchronous=NORMAL, which syncs the WAL before
+        # copying and the database file before the WAL is truncated.
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        conn.close()
+
+    print("✅ Successfully updated patient records database with proper separation of event data and health metrics.")
+    logging.info("Patient record import completed successfully")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import patient records from Excel workbooks into the SQLite database")
+    parser.add_argument("excel_files", nargs="*", default=EXCEL_FILES,
+                        help="Excel workbooks to import (default: the comma-separated EXCEL_FILES setting)")
+    parser.add_argument("--db-file", default=DB_FILE, help="SQLite database file (default: the DB_FILE setting)")
+    parser.add_argument("--fast-import", action="store_true",
+                        help="drop secondary indexes during the import and rebuild them at the end (for large loads)")
+    args = parser.parse_args()
+    run(args.excel_files, args.db_file, fast_import=args.fast_import)
@@ -1,16 +1,64 @@
 import os
-from datetime import datetime, timedelta
-from flask import Flask, request, jsonify, send_from_directory, render_template
+from datetime import date, datetime, timedelta
+from flask import Flask, request, jsonify, send_from_directory, render_template, g, has_app_context, Response
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
 import sqlite3
+import queue
 from dotenv import load_dotenv
 import functools
+import contextlib
 from reports import reporting
 
+# orjson encodes responses several times faster than the stdlib json module; use it when installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# whitenoise serves the built frontend from the WSGI layer before requests reach Flask; use it when installed
+try:
+    from whitenoise import WhiteNoise
+except ImportError:
+    WhiteNoise = None
+
+# flask-compress gzips (or brotli-encodes) responses for clients that accept it; use it when installed
+try:
+    from flask_compress import Compress
+except ImportError:
+    Compress = None
 
 
 load_dotenv()
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson, keeping Flask's sorted keys and fallback encoding for other types"""
+    option = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME if orjson else 0
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self.option).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=self.default, option=self.option),
+                                        mimetype=self.mimetype)
+
+
 app = Flask(__name__, static_folder="dist", static_url_path="")
+if orjson is not None:
+    app.json = OrjsonProvider(app)
+if WhiteNoise is not None and os.path.isdir(app.static_folder):
+    # Vite fingerprints everything it writes under assets/, so those files can be cached for good
+    app.wsgi_app = WhiteNoise(app.wsgi_app, root=app.static_folder, index_file=True,
+                              immutable_file_test=lambda path, url: url.startswith("/assets/"))
+if Compress is not None:
+    # Patient lists repeat the same keys on every row, so they shrink several times over; tiny replies are left alone
+    app.config.update(COMPRESS_MIMETYPES=["application/json"], COMPRESS_LEVEL=4, COMPRESS_MIN_SIZE=500)
+    Compress(app)
 DB_FILE = os.getenv("DB_FILE", "database/patient_records.db")
 
 CORS(app, 
@@ -23,38 +71,110 @@ app.register_blueprint(reporting)
 
 # --------- DATABASE SETUP AND UTILITIES ---------
 
-def db_connection():
+# journal_mode is stored in the database file, so WAL only has to be switched on once per process
+wal_enabled = False
+
+
+def open_db_connection():
     """Create and return a database connection with row factory"""
-    conn = sqlite3.connect(DB_FILE, isolation_level=None)  # autocommit mode
+    global wal_enabled
+    # Pooled connections live across requests, so a larger statement cache keeps every route's compiled SQL,
+    # including each sorted column set of the dynamic UPDATEs, instead of evicting at the default of 128
+    conn = sqlite3.connect(DB_FILE, isolation_level=None, check_same_thread=False,
+                           cached_statements=512)  # autocommit mode
     conn.row_factory = sqlite3.Row
     cursor = conn.cursor()
-    cursor.execute("PRAGMA synchronous = FULL")
-    cursor.execute("PRAGMA journal_mode = DELETE")
+    if not wal_enabled and DB_FILE != ":memory:":
+        cursor.execute("PRAGMA journal_mode = WAL")
+        wal_enabled = True
+    cursor.execute("PRAGMA synchronous = NORMAL")
+    cursor.execute("PRAGMA busy_timeout = 30000")
+    cursor.execute("PRAGMA temp_store = MEMORY")
+    cursor.execute("PRAGMA cache_size = -64000")
     return conn
 
 
+# Idle connections kept open for reuse across requests; at most POOL_SIZE are held
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+connection_pool = queue.SimpleQueue()
 
-def create_indexes():
-    """Create indexes on frequently queried columns for better performance"""
-    conn = db_connection()
-    cursor = conn.cursor()
+
+def checkout_db_connection():
+    """Take an idle connection from the pool, opening a new one if none is free"""
     try:
-        # Create indexes for common query fields
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_patient_visits_client_id ON patient_visits(client_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_patient_visits_visit_date ON patient_visits(visit_date)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_patients_goals_client_id ON patients_goals(client_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_patients_goals_visit_date ON patients_goals(visit_date)")
+        return connection_pool.get_nowait()
+    except queue.Empty:
+        return open_db_connection()
 
-        # Create index for search fields
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_patients_search ON patients(first_name, last_name, birthdate)")
 
-        conn.commit()
-    except sqlite3.Error as e:
-        print(f"Error creating indexes: {str(e)}")
-    finally:
+def release_db_connection(conn):
+    """Return a connection to the pool, or close it if the pool is already full"""
+    if conn.in_transaction:
+        conn.rollback()
+    if connection_pool.qsize() < POOL_SIZE:
+        connection_pool.put(conn)
+    else:
         conn.close()
 
 
+@contextlib.contextmanager
+def transaction(conn, mode=""):
+    """Run the block in one transaction: BEGIN on entry, COMMIT on success, ROLLBACK if it raises.
+
+    Connections are in autocommit mode, so statements outside such a block commit on their own.
+    """
+    conn.execute(f"BEGIN {mode}")
+    try:
+        yield conn
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def db_connection():
+    """Return the connection for the current app context, checking it out of the pool on first use.
+
+    Outside an app context (startup setup) a fresh connection is returned and the caller closes it.
+    """
+    if not has_app_context():
+        return open_db_connection()
+    if "db" not in g:
+        g.db = checkout_db_connection()
+    return g.db
+
+
+@app.teardown_appcontext
+def close_db_connection(exception):
+    """Hand the app context's connection back to the pool, rolling back anything left uncommitted"""
+    conn = g.pop("db", None)
+    if conn is not None:
+        release_db_connection(conn)
+
+
+
+def create_indexes(cursor):
+    """Create indexes on frequently queried columns for better performance"""
+    # Create indexes for common query fields
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_patient_visits_client_id ON patient_visits(client_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_patient_visits_visit_date ON patient_visits(visit_date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_patients_goals_client_id ON patients_goals(client_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_patients_goals_visit_date ON patients_goals(visit_date)")
+
+    # Per-patient visit history is read in visit_date order; same name as the import script's index
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_pv_client_date ON patient_visits(client_id, visit_date)")
+
+    # Create index for search fields
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_patients_search ON patients(first_name, last_name, birthdate)")
+
+    # Gather planner statistics the first time, afterwards only refresh them when SQLite thinks they are stale
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sqlite_stat1'")
+    if cursor.fetchone():
+        cursor.execute("PRAGMA optimize")
+    else:
+        cursor.execute("ANALYZE")
+
+
 def ensure_visit_time_column():
     """Ensure visit_time column exists in patient_visits table"""
     conn = db_connection()
@@ -69,25 +189,51 @@ def ensure_visit_time_column():
         conn.close()
 
 
-def ensure_birthdate_column():
+def ensure_birthdate_column(cursor):
     """Ensure birthdate column exists in patients table"""
-    conn = db_connection()
-    cursor = conn.cursor()
     try:
         cursor.execute("ALTER TABLE patients ADD COLUMN birthdate TEXT;")
-        conn.commit()
     except sqlite3.OperationalError:
         pass
-    finally:
-        conn.close()
+
+
+def split_padded_date(date_str, separator, year_first):
+    """Split a zero-padded MM/DD/YYYY or YYYY-MM-DD style string into (year, month, day) strings.
+
+    Returns None when the string has any other shape, so callers can fall back to strptime.
+    Raises ValueError for a well-formed string that is not a real calendar date.
+    """
+    if len(date_str) != 10 or not date_str.isascii():
+        return None
+    if year_first:
+        year, month, day = date_str[:4], date_str[5:7], date_str[8:]
+        separators = date_str[4] + date_str[7]
+    else:
+        month, day, year = date_str[:2], date_str[3:5], date_str[6:]
+        separators = date_str[2] + date_str[5]
+    if separators != separator * 2 or not (year + month + day).isdigit():
+        return None
+    date(int(year), int(month), int(day))
+    return year, month, day
 
 
 def standardize_birthdate(birthdate):
     """Convert birthdate to standard MM/DD/YY format"""
-    if not birthdate:
+    if not birthdate or not isinstance(birthdate, str):
         return None
+    return _standardize_birthdate(birthdate)
+
 
+# The date helpers are pure and parse with strptime; bulk requests repeat the same dates, so cache the results.
+# Only the str-only private helpers are cached, since request bodies can carry unhashable lists or dicts.
+@functools.lru_cache(maxsize=2048)
+def _standardize_birthdate(birthdate):
     try:
+        # Common MM/DD/YYYY input only needs its century dropped
+        parts = split_padded_date(birthdate, "/", year_first=False)
+        if parts:
+            year, month, day = parts
+            return f"{month}/{day}/{year[2:]}"
         birthdate_obj = datetime.strptime(birthdate, "%m/%d/%Y")
         return birthdate_obj.strftime("%m/%d/%y")
     except ValueError:
@@ -109,8 +255,19 @@ def standardize_date_for_db(date_str):
     """Convert any date format to YYYY-MM-DD format for database storage"""
     if not date_str:
         return None
+    if not isinstance(date_str, str):
+        print(f"Warning: Couldn't standardize date format: {date_str}")
+        return date_str  # Return original rather than None to avoid data loss
+    return _standardize_date_for_db(date_str)
 
+
+@functools.lru_cache(maxsize=2048)
+def _standardize_date_for_db(date_str):
     try:
+        # Already-padded YYYY-MM-DD needs no parsing beyond a calendar check
+        if split_padded_date(date_str, "-", year_first=True):
+            return date_str
+
         # First try standard YYYY-MM-DD format
         if '-' in date_str and len(date_str.split('-')[0]) == 4:
             datetime.strptime(date_str, "%Y-%m-%d")
@@ -142,6 +299,22 @@ def standardize_date_for_db(date_str):
         return date_str  # Return original rather than None
 
 
+def visit_month_year(first_visit_date):
+    """Return the MMYY part of a client ID for an MM/DD/YYYY first visit date"""
+    if not isinstance(first_visit_date, str):
+        raise ValueError(f"first visit date must be a string, got {type(first_visit_date).__name__}")
+    return _visit_month_year(first_visit_date)
+
+
+@functools.lru_cache(maxsize=2048)
+def _visit_month_year(first_visit_date):
+    parts = split_padded_date(first_visit_date, "/", year_first=False)
+    if parts:
+        year, month, day = parts
+        return f"{month}{year[2:]}"
+    return datetime.strptime(first_visit_date, "%m/%d/%Y").strftime("%m%y")
+
+
 def generate_client_id(first_name, last_name, first_visit_date, birthdate):
     """Generate client ID in format: FFMMYYMMDDYY"""
     if not all([first_name, last_name, first_visit_date, birthdate]):
@@ -150,10 +323,9 @@ def generate_client_id(first_name, last_name, first_visit_date, birthdate):
     try:
         first_initial = first_name[0].upper()
         last_initial = last_name[0].upper()
-        visit_date_obj = datetime.strptime(first_visit_date, "%m/%d/%Y")
-        visit_month_year = visit_date_obj.strftime("%m%y")  # MMYY format
+        month_year = visit_month_year(first_visit_date)  # MMYY format
 
-        return f"{first_initial}{last_initial}{visit_month_year}{birthdate.replace('/', '')}"  # MMDDYY
+        return f"{first_initial}{last_initial}{month_year}{birthdate.replace('/', '')}"  # MMDDYY
     except (IndexError, ValueError) as e:
         print(f"Error generating client ID: {str(e)}")
         return None
@@ -303,28 +475,25 @@ def get_patient_height(client_id):
     conn = db_connection()
     cursor = conn.cursor()
     
-    try:
-        # First check the patients table for height
-        cursor.execute("SELECT height FROM patients WHERE client_id = ?", (client_id,))
-        result = cursor.fetchone()
-        
-        if result and result["height"] is not None:
-            return result["height"]
-        
-        # If no height in patients table, look for the most recent visit with height
-        cursor.execute("""
-            SELECT height FROM patient_visits 
-            WHERE client_id = ? AND height IS NOT NULL 
-            ORDER BY visit_date DESC LIMIT 1
-        """, (client_id,))
+    # First check the patients table for height
+    cursor.execute("SELECT height FROM patients WHERE client_id = ?", (client_id,))
+    result = cursor.fetchone()
+    
+    if result and result["height"] is not None:
+        return result["height"]
+    
+    # If no height in patients table, look for the most recent visit with height
+    cursor.execute("""
+        SELECT height FROM patient_visits 
+        WHERE client_id = ? AND height IS NOT NULL 
+        ORDER BY visit_date DESC LIMIT 1
+    """, (client_id,))
+    
+    result = cursor.fetchone()
+    if result:
+        return result["height"]
         
-        result = cursor.fetchone()
-        if result:
-            return result["height"]
-            
-        return None
-    finally:
-        conn.close()
+    return None
 
 # Expose the new function through a route if needed
 @app.route("/patients/<client_id>/height", methods=["GET"])
@@ -336,34 +505,91 @@ def get_height(client_id):
     return jsonify({"height": height})
 
 
-# Initialize database setup
-ensure_birthdate_column()
-create_indexes()
+def ensure_activity_log_table(cursor):
+    """Ensure activity_log table exists"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS activity_log (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        activity_type TEXT NOT NULL,  -- 'create', 'read', 'update', 'delete'
+        entity_type TEXT NOT NULL,    -- 'patient', 'visit', 'goals'
+        entity_id TEXT NOT NULL,      -- client_id, visit_id, etc.
+        entity_name TEXT,             -- patient name, etc.
+        timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
+        additional_info TEXT          -- any extra info
+    )
+    ''')
+
 
+def ensure_patients_fts(cursor):
+    """Ensure the patients_fts trigram index exists and is kept in sync with patients by triggers"""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'patients_fts'")
+    exists = cursor.fetchone() is not None
 
-def ensure_activity_log_table():
-    """Ensure activity_log table exists"""
+    # patients has a TEXT primary key, so the index is keyed on its implicit rowid, which VACUUM may renumber.
+    # After any VACUUM the index must be rebuilt: INSERT INTO patients_fts (patients_fts) VALUES ('rebuild')
+    cursor.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS patients_fts USING fts5(
+        client_id, first_name, last_name, birthdate, age,
+        content='patients', content_rowid='rowid', tokenize='trigram'
+    )
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS patients_fts_insert AFTER INSERT ON patients BEGIN
+        INSERT INTO patients_fts (rowid, client_id, first_name, last_name, birthdate, age)
+        VALUES (new.rowid, new.client_id, new.first_name, new.last_name, new.birthdate, new.age);
+    END
+    ''')
+    cursor.execute('''
+    CREATE TRIGGER IF NOT EXISTS patients_fts_delete AFTER DELETE ON patients BEGIN
+        INSERT INTO patients_fts (patients_fts, rowid, client_id, first_name, last_name, birthdate, age)
+        VALUES ('delete', old.rowid, old.client_id, old.first_name, old.last_name, old.birthdate, old.age);
+    END
+    ''')
+    # Only fires when an indexed column actually changes: the import's upsert names these columns in its SET
+    # for every patient, so UPDATE OF alone would still re-index each one on every import. Recreated so
+    # databases with the earlier unconditional trigger pick this one up.
+    cursor.execute("DROP TRIGGER IF EXISTS patients_fts_update")
+    cursor.execute('''
+    CREATE TRIGGER patients_fts_update AFTER UPDATE OF client_id, first_name, last_name, birthdate, age ON patients
+    WHEN old.client_id IS NOT new.client_id OR old.first_name IS NOT new.first_name
+        OR old.last_name IS NOT new.last_name OR old.birthdate IS NOT new.birthdate OR old.age IS NOT new.age
+    BEGIN
+        INSERT INTO patients_fts (patients_fts, rowid, client_id, first_name, last_name, birthdate, age)
+        VALUES ('delete', old.rowid, old.client_id, old.first_name, old.last_name, old.birthdate, old.age);
+        INSERT INTO patients_fts (rowid, client_id, first_name, last_name, birthdate, age)
+        VALUES (new.rowid, new.client_id, new.first_name, new.last_name, new.birthdate, new.age);
+    END
+    ''')
+    if not exists:
+        # Index the patients that were there before the table existed
+        cursor.execute("INSERT INTO patients_fts (patients_fts) VALUES ('rebuild')")
+
+
+# Bump when the startup steps below change, so existing databases run them once more
+APP_SCHEMA_VERSION = 2
+
+
+def migrate_database():
+    """Run the startup schema steps in one transaction, skipped once PRAGMA user_version is current"""
     conn = db_connection()
     cursor = conn.cursor()
     try:
-        cursor.execute('''
-        CREATE TABLE IF NOT EXISTS activity_log (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            activity_type TEXT NOT NULL,  -- 'create', 'read', 'update', 'delete'
-            entity_type TEXT NOT NULL,    -- 'patient', 'visit', 'goals'
-            entity_id TEXT NOT NULL,      -- client_id, visit_id, etc.
-            entity_name TEXT,             -- patient name, etc.
-            timestamp TEXT DEFAULT CURRENT_TIMESTAMP,
-            additional_info TEXT          -- any extra info
-        )
-        ''')
-        conn.commit()
+        cursor.execute("PRAGMA user_version")
+        if cursor.fetchone()[0] >= APP_SCHEMA_VERSION:
+            return
+
+        with transaction(conn, "IMMEDIATE"):
+            ensure_birthdate_column(cursor)
+            create_indexes(cursor)
+            ensure_activity_log_table(cursor)
+            ensure_patients_fts(cursor)
+            cursor.execute(f"PRAGMA user_version = {APP_SCHEMA_VERSION}")
     except sqlite3.Error as e:
-        print(f"Error creating activity_log table: {str(e)}")
+        print(f"Error migrating database: {str(e)}")
     finally:
         conn.close()
 # Call it during initialization
-ensure_activity_log_table()
+migrate_database()
 
 def log_activity(activity_type, entity_type, entity_id, entity_name, additional_info=None):
     """Log an activity in the activity_log table"""
@@ -377,8 +603,6 @@ def log_activity(activity_type, entity_type, entity_id, entity_name, additional_
             VALUES (?, ?, ?, ?, ?)
         ''', (activity_type, entity_type, entity_id, entity_name, additional_info))
         
-        conn.commit()
-        conn.close()
         return True
     except Exception as e:
         print(f"Error logging activity: {str(e)}")
@@ -414,14 +638,79 @@ def setup_database():
     )
     ''')
     
-    conn.commit()
-    conn.close()
-    
     return jsonify({"message": "Database setup completed"})
 
 
 # --------- PATIENT CRUD OPERATIONS ---------
 
+# Columns request bodies may write. Keys are checked against these and sorted before being put into
+# dynamically built SQL, so only known columns reach the statement and each field set yields one SQL string
+PATIENT_COLUMNS = frozenset({
+    "first_name", "last_name", "gender", "age", "race", "primary_lang", "insurance", "phone", "zipcode",
+    "first_visit_date", "birthdate", "height"
+})
+GOAL_COLUMNS = frozenset({
+    "increased_fruit_veg", "increased_water", "increased_exercise", "cut_tv_viewing", "eat_breakfast",
+    "limit_alcohol", "no_late_eating", "more_whole_grains", "less_fried_foods", "low_fat_milk", "lower_salt",
+    "annual_checkup", "quit_smoking"
+})
+VISIT_COLUMNS = frozenset({
+    "visit_date", "visit_time", "event_type", "referral_source", "follow_up", "hra", "edu", "case_management",
+    "systolic", "diastolic", "cholesterol", "fasting", "glucose", "height", "weight", "bmi", "a1c", "acquired_by"
+})
+
+# Latest goals row per patient, joined as alias g and rendered as a JSON object (NULL when none)
+LATEST_GOALS_JOIN_SQL = """LEFT JOIN patients_goals g ON g.client_id = p.client_id
+        AND g.visit_date = (SELECT MAX(visit_date) FROM patients_goals WHERE client_id = p.client_id)"""
+
+LATEST_GOALS_JSON_SQL = """CASE WHEN g.client_id IS NULL THEN NULL ELSE json_object(
+    'client_id', g.client_id,
+    'visit_date', g.visit_date,
+    'increased_fruit_veg', g.increased_fruit_veg,
+    'increased_water', g.increased_water,
+    'increased_exercise', g.increased_exercise,
+    'cut_tv_viewing', g.cut_tv_viewing,
+    'eat_breakfast', g.eat_breakfast,
+    'limit_alcohol', g.limit_alcohol,
+    'no_late_eating', g.no_late_eating,
+    'more_whole_grains', g.more_whole_grains,
+    'less_fried_foods', g.less_fried_foods,
+    'low_fat_milk', g.low_fat_milk,
+    'lower_salt', g.lower_salt,
+    'annual_checkup', g.annual_checkup,
+    'quit_smoking', g.quit_smoking,
+    'visit_id', g.visit_id
+) END"""
+
+# Total patient count plus a page of patients with their latest goals, serialized to a JSON array by SQLite
+PATIENTS_JSON_SQL = f"""
+    SELECT (SELECT COUNT(*) FROM patients) AS count, json_group_array(json_object(
+        'client_id', p.client_id,
+        'first_name', p.first_name,
+        'last_name', p.last_name,
+        'gender', p.gender,
+        'age', p.age,
+        'race', p.race,
+        'primary_lang', p.primary_lang,
+        'insurance', p.insurance,
+        'phone', p.phone,
+        'zipcode', p.zipcode,
+        'first_visit_date', p.first_visit_date,
+        'birthdate', p.birthdate,
+        'height', p.height,
+        'goals', {LATEST_GOALS_JSON_SQL}
+    )) AS patients
+    FROM (SELECT * FROM patients LIMIT ? OFFSET ?) p
+    {LATEST_GOALS_JOIN_SQL}
+"""
+
+PATIENT_WITH_GOALS_SQL = f"""
+    SELECT p.*, {LATEST_GOALS_JSON_SQL} AS latest_goals
+    FROM patients p
+    {LATEST_GOALS_JOIN_SQL}
+    WHERE p.client_id = ?
+"""
+
 @app.route("/patients", methods=["GET"])
 @handle_errors
 def get_patients():
@@ -440,53 +729,24 @@ def get_patients():
     conn = db_connection()
     cursor = conn.cursor()
 
-    # Get total count for pagination info
-    cursor.execute("SELECT COUNT(*) as count FROM patients")
-    total_count = cursor.fetchone()["count"]
+    # Get the total count for pagination info and the page of patients, with their latest goals, in one query
+    cursor.execute(PATIENTS_JSON_SQL, (limit, offset))
+    total_count, patients_json = cursor.fetchone()
 
-    # Get paginated patient data
-    cursor.execute("SELECT * FROM patients LIMIT ? OFFSET ?", (limit, offset))
-    patients = cursor.fetchall()
-
-    # Get latest goals for these patients
-    # Only get goals for the patients in the current page
-    if patients:
-        patient_ids = [patient["client_id"] for patient in patients]
-        placeholders = ','.join(['?'] * len(patient_ids))
-
-        cursor.execute(f"""
-            SELECT g.*
-            FROM patients_goals g
-            INNER JOIN (
-                SELECT client_id, MAX(visit_date) AS latest_visit
-                FROM patients_goals
-                WHERE client_id IN ({placeholders})
-                GROUP BY client_id
-            ) latest_goal ON g.client_id = latest_goal.client_id AND g.visit_date = latest_goal.latest_visit
-        """, patient_ids)
-        goals = cursor.fetchall()
-
-        goals_dict = {goal["client_id"]: dict(goal) for goal in goals}
-    else:
-        goals_dict = {}
-
-    conn.close()
-
-    patients_list = [dict(patient) for patient in patients]
+    # Return with pagination info
+    pagination = {
+        "total": total_count,
+        "page": page,
+        "limit": limit,
+        "pages": (total_count + limit - 1) // limit  # Ceiling division
+    }
+    return Response(f'{{"patients": {patients_json}, "pagination": {app.json.dumps(pagination)}}}',
+                    mimetype="application/json")
 
-    for patient in patients_list:
-        patient["goals"] = goals_dict.get(patient["client_id"], None)  # Include latest goals
 
-    # Return with pagination info
-    return jsonify({
-        "patients": patients_list,
-        "pagination": {
-            "total": total_count,
-            "page": page,
-            "limit": limit,
-            "pages": (total_count + limit - 1) // limit  # Ceiling division
-        }
-    })
+# Columns the search results list shows; the detail view fetches the rest
+SEARCH_RESULT_COLUMNS = ("client_id", "first_name", "last_name", "age", "gender", "first_visit_date", "phone")
+SEARCH_RESULT_LIMIT = 50
 
 
 @app.route("/patients/search", methods=["GET"])
@@ -500,21 +760,36 @@ def search_patients():
     cursor = conn.cursor()
 
     # Search by client ID, first name, last name, birthdate, or age
-    cursor.execute("""
-        SELECT * FROM patients 
-        WHERE client_id LIKE ? 
-        OR first_name LIKE ? 
-        OR last_name LIKE ? 
-        OR birthdate LIKE ? 
-        OR CAST(age AS TEXT) LIKE ?
-    """, (f"%{query}%", f"%{query}%", f"%{query}%", f"%{query}%", f"%{query}%"))
-    results = cursor.fetchall()
-    conn.close()
-
-    if not results:
+    columns = ", ".join(f"p.{column}" for column in SEARCH_RESULT_COLUMNS)
+    if len(query) >= 3:
+        # The trigram index matches the query as a substring of any indexed column, like the LIKE scan below;
+        # rank is FTS5's bm25 score, so the best matches come first
+        cursor.execute(f"""
+            SELECT {columns} FROM patients_fts f
+            JOIN patients p ON p.rowid = f.rowid
+            WHERE patients_fts MATCH ?
+            ORDER BY f.rank
+            LIMIT ?
+        """, ('"' + query.replace('"', '""') + '"', SEARCH_RESULT_LIMIT))
+    else:
+        # Trigrams need at least three characters, so shorter queries scan
+        cursor.execute(f"""
+            SELECT {columns} FROM patients p 
+            WHERE client_id LIKE ? 
+            OR first_name LIKE ? 
+            OR last_name LIKE ? 
+            OR birthdate LIKE ? 
+            OR CAST(age AS TEXT) LIKE ?
+            LIMIT ?
+        """, (f"%{query}%", f"%{query}%", f"%{query}%", f"%{query}%", f"%{query}%", SEARCH_RESULT_LIMIT))
+    # At most SEARCH_RESULT_LIMIT rows, so they are read in full before responding and any database
+    # error still reaches handle_errors instead of cutting off a response that has already started
+    patients = cursor.fetchall()
+
+    if not patients:
         return jsonify({"message": "No matching patients found"}), 404
 
-    return jsonify([dict(row) for row in results])
+    return jsonify([dict(zip(SEARCH_RESULT_COLUMNS, row)) for row in patients])
 
 
 @app.route("/patients/<client_id>", methods=["GET"])
@@ -523,13 +798,17 @@ def get_patient(client_id):
     conn = db_connection()
     cursor = conn.cursor()
 
-    # Fetch patient info
-    cursor.execute("SELECT * FROM patients WHERE client_id = ?", (client_id,))
+    # Fetch patient info together with the latest goals
+    cursor.execute(PATIENT_WITH_GOALS_SQL, (client_id,))
     patient = cursor.fetchone()
 
     if not patient:
         return jsonify({"error": "Patient not found"}), 404
 
+    patient_info = dict(patient)
+    latest_goals = patient_info.pop("latest_goals")
+    latest_goals = app.json.loads(latest_goals) if latest_goals else None
+
 
     # Fetch all patient visits sorted by visit_date
     cursor.execute("""
@@ -541,21 +820,11 @@ def get_patient(client_id):
 
     visits = cursor.fetchall()
 
-    # Get patient goals
-    cursor.execute("""
-        SELECT * FROM patients_goals
-        WHERE client_id = ?
-        ORDER BY visit_date DESC
-        LIMIT 1
-    """, (client_id,))
-    latest_goals = cursor.fetchone()
-
     # Handle case with no visits
     if not visits:
-        conn.close()
         return jsonify({
-            "patient_info": dict(patient),
-            "latest_goals": dict(latest_goals) if latest_goals else None,
+            "patient_info": patient_info,
+            "latest_goals": latest_goals,
             "latest_changes": None,
             "trend": []
         })
@@ -603,12 +872,11 @@ def get_patient(client_id):
             "weight_percentage_change": None
         }
 
-    conn.close()
 
     # Construct response
     response = {
-        "patient_info": dict(patient),
-        "latest_goals": dict(latest_goals) if latest_goals else None,
+        "patient_info": patient_info,
+        "latest_goals": latest_goals,
         "latest_changes": changes,
         "trend": visits_list  # Full visit history for visualization
     }
@@ -654,10 +922,10 @@ def add_patient():
     conn = db_connection()
     cursor = conn.cursor()
 
-    try:
+    with transaction(conn):
         # Insert patient data with standardized dates
         cursor.execute('''
-            INSERT INTO patients (client_id, first_name, last_name, gender, age, race, primary_lang, 
+            INSERT OR IGNORE INTO patients (client_id, first_name, last_name, gender, age, race, primary_lang, 
                 insurance, phone, zipcode, first_visit_date, birthdate, height)
             VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         ''', (
@@ -675,11 +943,15 @@ def add_patient():
             birthdate_db,  # Use the standardized YYYY-MM-DD format
             data.get("height")
         ))
+        if cursor.rowcount == 0:
+            return jsonify({"error": "Patient with this client_id already exists"}), 400
+
         # Handle goals data if provided
         goals_inserted = False
         if goals_data and isinstance(goals_data, dict):
             # Convert boolean/truthy values to 0/1
-            processed_goals = {key: 1 if value else 0 for key, value in goals_data.items()}
+            processed_goals = {key: 1 if value else 0 for key, value in sorted(goals_data.items())
+                               if key in GOAL_COLUMNS}
 
             if processed_goals:
                 # Convert first_visit_date to YYYY-MM-DD format for goals table
@@ -702,19 +974,12 @@ def add_patient():
                     print(f"Error: Could not convert visit date '{data.get('first_visit_date')}' to YYYY-MM-DD format")
         log_activity('create', 'patient', client_id, f"{data.get('first_name')} {data.get('last_name')}")
 
-        conn.commit()
-        conn.close()
-
-        return jsonify({
-            "message": "Patient added successfully",
-            "client_id": client_id,
-            "birthdate": birthdate_db,
-            "goals_added": goals_inserted
-        }), 201
-
-    except sqlite3.IntegrityError:
-        conn.close()
-        return jsonify({"error": "Patient with this client_id already exists"}), 400
+    return jsonify({
+        "message": "Patient added successfully",
+        "client_id": client_id,
+        "birthdate": birthdate_db,
+        "goals_added": goals_inserted
+    }), 201
 
 
 @app.route("/patients/<client_id>", methods=["PATCH"])
@@ -736,7 +1001,6 @@ def update_patient(client_id):
     patient_record = cursor.fetchone()
 
     if not patient_record:
-        conn.close()
         return jsonify({"error": "Patient not found"}), 404
 
     # Convert patient record to dict for easier access
@@ -749,9 +1013,9 @@ def update_patient(client_id):
     fields = []
     values = []
 
-    for key, value in data.items():
-        # Skip empty values to preserve original data
-        if value is None or value == "":
+    for key, value in sorted(data.items()):
+        # Skip unknown fields, and empty values to preserve original data
+        if key not in PATIENT_COLUMNS or value is None or value == "":
             continue
 
         # In update_patient, change this section:
@@ -759,19 +1023,16 @@ def update_patient(client_id):
             # First get the MM/DD/YY format for validation
             value_short = standardize_birthdate(value)
             if not value_short:
-                conn.close()
                 return jsonify({"error": "Invalid birthdate format"}), 400
 
             # But store the YYYY-MM-DD format in the database
             value = standardize_date_for_db(value)
             if not value:
-                conn.close()
                 return jsonify({"error": "Failed to convert birthdate to standard format"}), 400
 
         if key == "first_visit_date" and value:  # Handle first_visit_date proper formatting
             value = standardize_date_for_db(value)
             if not value:
-                conn.close()
                 return jsonify({"error": "Invalid first_visit_date format"}), 400
 
         # Preserve fields as-is, without converting case
@@ -782,10 +1043,7 @@ def update_patient(client_id):
     patient_updated = False
     goals_updated = False
 
-    try:
-        # Begin transaction
-        cursor.execute("BEGIN TRANSACTION")
-
+    with transaction(conn):
         # Update patient information if there are fields to update
         if fields:
             # Update patient information
@@ -798,7 +1056,8 @@ def update_patient(client_id):
         # Handle goals update if goals data is provided
         if goals_data and isinstance(goals_data, dict):
             # Convert boolean/truthy values to 0/1
-            processed_goals = {key: 1 if value else 0 for key, value in goals_data.items()}
+            processed_goals = {key: 1 if value else 0 for key, value in sorted(goals_data.items())
+                               if key in GOAL_COLUMNS}
 
             if processed_goals:
                 # Get the visit date to use for goals - prefer the one in the update if provided
@@ -860,28 +1119,6 @@ def update_patient(client_id):
             # Don't fail the update if logging fails
             print(f"Error logging update activity: {str(log_error)}")
 
-        # Commit all changes
-        cursor.execute("COMMIT")
-
-    except Exception as e:
-        # Roll back on error
-        try:
-            cursor.execute("ROLLBACK")
-        except:
-            pass  # If rollback fails, continue to close connection
-
-        print(f"Error updating patient: {str(e)}")
-        import traceback
-        traceback.print_exc()
-
-        # Ensure the connection gets closed
-        conn.close()
-
-        # Re-raise the exception to be handled by the @handle_errors decorator
-        raise e
-
-    # Close the connection after successful transaction
-    conn.close()
 
     if patient_updated or goals_updated:
         return jsonify({
@@ -902,7 +1139,6 @@ def get_patient_goals_history(client_id):
     # First verify patient exists
     cursor.execute("SELECT 1 FROM patients WHERE client_id = ?", (client_id,))
     if not cursor.fetchone():
-        conn.close()
         return jsonify({"error": "Patient not found"}), 404
 
     # Get all goals with visit_date
@@ -915,7 +1151,6 @@ def get_patient_goals_history(client_id):
     """, (client_id,))
 
     goals = cursor.fetchall()
-    conn.close()
 
     if goals:
         return jsonify([dict(row) for row in goals])
@@ -934,14 +1169,12 @@ def delete_patient(client_id):
     patient = cursor.fetchone()
 
     if not patient:
-        conn.close()
         return jsonify({"error": "Patient not found"}), 404
 
     patient_name = patient["name"]
 
     # Begin transaction
-    cursor.execute("BEGIN TRANSACTION")
-    try:
+    with transaction(conn):
         # Delete related records
         cursor.execute("DELETE FROM patient_visits WHERE client_id = ?", (client_id,))
         cursor.execute("DELETE FROM patients_goals WHERE client_id = ?", (client_id,))
@@ -955,13 +1188,7 @@ def delete_patient(client_id):
                 VALUES (?, ?, ?, ?)
             ''', ('delete', 'patient', client_id, patient_name))
 
-        cursor.execute("COMMIT")
-    except Exception as e:
-        cursor.execute("ROLLBACK")
-        conn.close()
-        raise e
 
-    conn.close()
     return jsonify({"message": "Patient deleted successfully"})
 
 # --------- PATIENT GOALS CRUD OPERATIONS ---------
@@ -976,12 +1203,10 @@ def get_patient_goals(client_id):
     # First verify patient exists
     cursor.execute("SELECT 1 FROM patients WHERE client_id = ?", (client_id,))
     if not cursor.fetchone():
-        conn.close()
         return jsonify({"error": "Patient not found"}), 404
 
     cursor.execute("SELECT * FROM patients_goals WHERE client_id = ? ORDER BY visit_date DESC", (client_id,))
     goals = cursor.fetchall()
-    conn.close()
 
     if goals:
         return jsonify([dict(row) for row in goals])
@@ -989,6 +1214,17 @@ def get_patient_goals(client_id):
         return jsonify([])  # Return empty array instead of error for easier frontend handling
 
 
+# One upsert covering every goal column in a fixed order; fields a request leaves out are bound as NULL,
+# which keeps the stored value on conflict and leaves the column empty on insert
+SORTED_GOAL_COLUMNS = tuple(sorted(GOAL_COLUMNS))
+GOALS_UPSERT_SQL = f"""
+    INSERT INTO patients_goals (client_id, visit_date, {", ".join(SORTED_GOAL_COLUMNS)})
+    VALUES (?, ?, {", ".join("?" for _ in SORTED_GOAL_COLUMNS)})
+    ON CONFLICT(client_id, visit_date) DO UPDATE SET
+    {", ".join(f"{goal} = COALESCE(excluded.{goal}, {goal})" for goal in SORTED_GOAL_COLUMNS)}
+"""
+
+
 # Add a new goal entry for a patient
 @app.route("/patients/<client_id>/goals", methods=["POST"])
 @handle_errors
@@ -1006,18 +1242,16 @@ def add_patient_goals(client_id):
     cursor = conn.cursor()
     cursor.execute("SELECT 1 FROM patients WHERE client_id = ?", (client_id,))
     if not cursor.fetchone():
-        conn.close()
         return jsonify({"error": "Patient not found"}), 404
 
     # Ensure all goal values are either 1 or 0
-    goals_data = {key: (1 if data.get(key) else 0) for key in data if key != "visit_date"}
+    goals_data = {key: (1 if data.get(key) else 0) for key in sorted(data) if key in GOAL_COLUMNS}
 
     # Standardize the visit date to YYYY-MM-DD format
     original_visit_date = data.get("visit_date")
     visit_date = standardize_date_for_db(original_visit_date)
 
     if not visit_date:
-        conn.close()
         return jsonify({
                            "error": f"Invalid visit_date format: {original_visit_date}. Use YYYY-MM-DD, MM/DD/YYYY, or other standard date formats"}), 400
 
@@ -1027,7 +1261,6 @@ def add_patient_goals(client_id):
         (client_id, visit_date)
     )
     if not cursor.fetchone() and not data.get("force_create", False):
-        conn.close()
         return jsonify({
             "error": "No visit record found for this date",
             "details": "Set force_create=true to create goals without a visit record"
@@ -1035,22 +1268,60 @@ def add_patient_goals(client_id):
 
     # If no goals data provided, return error
     if not goals_data:
-        conn.close()
         return jsonify({"error": "No goals data provided"}), 400
 
-    # Build and execute the query
-    cursor.execute(f'''
-        INSERT INTO patients_goals (client_id, visit_date, {", ".join(goals_data.keys())})
-        VALUES (?, ?, {", ".join(["?" for _ in goals_data])})
-        ON CONFLICT(client_id, visit_date) DO UPDATE SET
-        {", ".join([f"{goal} = excluded.{goal}" for goal in goals_data.keys()])}
-    ''', (client_id, visit_date) + tuple(goals_data.values()))
+    cursor.execute(GOALS_UPSERT_SQL, (client_id, visit_date) + tuple(goals_data.get(goal) for goal in SORTED_GOAL_COLUMNS))
 
-    conn.commit()
-    conn.close()
     return jsonify({"message": "Goals added/updated successfully"}), 201
 
 
+# Add or update goals for many visit dates in one request and one transaction
+@app.route("/patients/<client_id>/goals/bulk", methods=["POST"])
+@handle_errors
+def add_patient_goals_bulk(client_id):
+    entries = request.json
+    if not entries or not isinstance(entries, list):
+        return jsonify({"error": "A list of goals entries is required"}), 400
+
+    conn = db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM patients WHERE client_id = ?", (client_id,))
+    if not cursor.fetchone():
+        return jsonify({"error": "Patient not found"}), 404
+
+    cursor.execute("SELECT DISTINCT visit_date FROM patient_visits WHERE client_id = ?", (client_id,))
+    visit_dates = {row["visit_date"] for row in cursor.fetchall()}
+
+    goal_rows = []
+    for index, data in enumerate(entries):
+        if not isinstance(data, dict) or not data.get("visit_date"):
+            return jsonify({"error": f"visit_date is required for entry {index}"}), 400
+
+        visit_date = standardize_date_for_db(data["visit_date"])
+        if not visit_date:
+            return jsonify({"error": f"Invalid visit_date format for entry {index}: {data['visit_date']}"}), 400
+        if visit_date not in visit_dates and not data.get("force_create", False):
+            return jsonify({
+                "error": f"No visit record found for entry {index}",
+                "details": "Set force_create=true to create goals without a visit record"
+            }), 400
+
+        if not any(key in GOAL_COLUMNS for key in data):
+            return jsonify({"error": f"No goals data provided for entry {index}"}), 400
+
+        goal_rows.append((client_id, visit_date) + tuple(
+            (1 if data[goal] else 0) if goal in data else None for goal in SORTED_GOAL_COLUMNS
+        ))
+
+    with transaction(conn, "IMMEDIATE"):
+        cursor.executemany(GOALS_UPSERT_SQL, goal_rows)
+
+    return jsonify({
+        "message": "Goals added/updated successfully",
+        "entries_saved": len(entries)
+    }), 201
+
+
 # Update existing goals for a specific visit
 @app.route("/patients/<client_id>/goals/<visit_date>", methods=["PATCH"])
 @handle_errors
@@ -1068,15 +1339,14 @@ def update_patient_goals(client_id, visit_date):
         (client_id, visit_date)
     )
     if not cursor.fetchone():
-        conn.close()
         return jsonify({"error": "No goals found for this patient and visit date"}), 404
 
     fields = []
     values = []
 
-    for key, value in data.items():
-        if key in ("client_id", "visit_date"):
-            continue  # Skip primary keys
+    for key, value in sorted(data.items()):
+        if key not in GOAL_COLUMNS:
+            continue  # Skip primary keys and unknown fields
 
         fields.append(f"{key}=?")
         # Convert boolean/truthy values to 0/1
@@ -1086,7 +1356,6 @@ def update_patient_goals(client_id, visit_date):
             values.append(0)
 
     if not fields:
-        conn.close()
         return jsonify({"error": "No valid goals provided to update"}), 400
 
     values.append(client_id)
@@ -1094,8 +1363,6 @@ def update_patient_goals(client_id, visit_date):
     sql = f"UPDATE patients_goals SET {', '.join(fields)} WHERE client_id=? AND visit_date=?"
 
     cursor.execute(sql, tuple(values))
-    conn.commit()
-    conn.close()
     return jsonify({"message": "Patient goals updated successfully"})
 
 
@@ -1112,17 +1379,46 @@ def delete_patient_goals(client_id, visit_date):
         (client_id, visit_date)
     )
     if not cursor.fetchone():
-        conn.close()
         return jsonify({"error": "No goals found for this patient and visit date"}), 404
 
     cursor.execute("DELETE FROM patients_goals WHERE client_id = ? AND visit_date = ?", (client_id, visit_date))
-    conn.commit()
-    conn.close()
     return jsonify({"message": "Patient goals deleted successfully"})
 
 
 # --------- VISIT CRUD OPERATIONS ---------
 
+# A patient's visits, newest first, serialized to a JSON array by SQLite
+PATIENT_VISITS_JSON_SQL = """
+    SELECT json_group_array(json_object(
+        'id', v.id,
+        'client_id', v.client_id,
+        'visit_date', v.visit_date,
+        'event_type', v.event_type,
+        'referral_source', v.referral_source,
+        'follow_up', v.follow_up,
+        'hra', v.hra,
+        'edu', v.edu,
+        'case_management', v.case_management,
+        'systolic', v.systolic,
+        'diastolic', v.diastolic,
+        'cholesterol', v.cholesterol,
+        'fasting', v.fasting,
+        'glucose', v.glucose,
+        'height', v.height,
+        'weight', v.weight,
+        'bmi', v.bmi,
+        'a1c', v.a1c,
+        'acquired_by', v.acquired_by,
+        'visit_time', v.visit_time,
+        'display_datetime', CASE WHEN v.visit_time != '' THEN v.visit_date || ' ' || v.visit_time ELSE v.visit_date END
+    ))
+    FROM (
+        SELECT * FROM patient_visits
+        WHERE client_id = ?
+        ORDER BY visit_date DESC, visit_time DESC
+    ) v
+"""
+
 # Get all visits for a patient
 @app.route("/patients/<client_id>/visits", methods=["GET"])
 @handle_errors
@@ -1133,29 +1429,58 @@ def get_patient_visits(client_id):
     # First verify patient exists
     cursor.execute("SELECT 1 FROM patients WHERE client_id = ?", (client_id,))
     if not cursor.fetchone():
-        conn.close()
         return jsonify({"error": "Patient not found"}), 404
 
     # Include visit_time in the ordering
-    cursor.execute("""
-        SELECT * FROM patient_visits 
-        WHERE client_id = ? 
-        ORDER BY visit_date DESC, visit_time DESC
-    """, (client_id,))
-    visits = cursor.fetchall()
-    conn.close()
-
-    if visits:
-        visit_list = [dict(row) for row in visits]
-        # Format a display string for each visit
-        for visit in visit_list:
-            if visit.get("visit_time"):
-                visit["display_datetime"] = f"{visit['visit_date']} {visit['visit_time']}"
-            else:
-                visit["display_datetime"] = visit['visit_date']
-        return jsonify(visit_list)
-    else:
-        return jsonify([])
+    cursor.execute(PATIENT_VISITS_JSON_SQL, (client_id,))
+    return Response(cursor.fetchone()[0], mimetype="application/json")
+
+
+PATIENT_VISIT_INSERT_SQL = """
+    INSERT INTO patient_visits (
+        client_id, visit_date, visit_time, event_type, referral_source, follow_up, 
+        hra, edu, case_management, systolic, diastolic, cholesterol, 
+        fasting, glucose, height, weight, bmi, a1c, acquired_by
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+def prepare_visit_row(client_id, data):
+    """Fill in visit_time and BMI on a validated visit and return its patient_visits insert values"""
+    # If visit_time is not provided, generate one
+    if "visit_time" not in data or not data["visit_time"]:
+        data["visit_time"] = datetime.now().strftime("%H:%M")
+
+    # Calculate BMI if height and weight are provided
+    height = data.get("height")
+    weight = data.get("weight")
+
+    if height is not None and weight is not None:
+        # Calculate BMI on the backend
+        data["bmi"] = calculate_bmi(height, weight)
+
+    return (
+        client_id,
+        data["visit_date"],
+        data["visit_time"],
+        data.get("event_type"),
+        data.get("referral_source"),
+        data.get("follow_up"),
+        data.get("hra"),
+        data.get("edu"),
+        data.get("case_management"),
+        data.get("systolic"),
+        data.get("diastolic"),
+        data.get("cholesterol"),
+        data.get("fasting"),
+        data.get("glucose"),
+        data.get("height"),
+        data.get("weight"),
+        data.get("bmi"),
+        data.get("a1c"),
+        data.get("acquired_by")
+    )
 
 
 # Add a new visit for a patient
@@ -1179,85 +1504,39 @@ def add_patient_visit(client_id):
     cursor = conn.cursor()
     cursor.execute("SELECT 1 FROM patients WHERE client_id = ?", (client_id,))
     if not cursor.fetchone():
-        conn.close()
         return jsonify({"error": "Patient not found"}), 404
 
-    # If visit_time is not provided, generate one
-    if "visit_time" not in data or not data["visit_time"]:
-        data["visit_time"] = datetime.now().strftime("%H:%M")
+    visit_data = prepare_visit_row(client_id, data)
 
-    # Calculate BMI if height and weight are provided
-    height = data.get("height")
-    weight = data.get("weight")
+    with transaction(conn):
+        # Standard insert without duplicate check (since you've removed the UNIQUE constraint)
+        cursor.execute(PATIENT_VISIT_INSERT_SQL, visit_data)
 
-    if height is not None and weight is not None:
-        # Calculate BMI on the backend
-        data["bmi"] = calculate_bmi(height, weight)
+        visit_id = cursor.lastrowid  # Get the auto-generated visit ID from SQLite
 
-    # Create a clean copy of data without the goals field for the visit table
-    visit_data_dict = {k: v for k, v in data.items() if k != "goals"}
+        # If there's a goals field in the data, create goals for this visit
+        if "goals" in data and isinstance(data["goals"], dict):
+            goals_data = {key: 1 if value else 0 for key, value in sorted(data["goals"].items()) if key in GOAL_COLUMNS}
 
-    # Prepare data for insertion, handling nulls appropriately
-    visit_data = [
-        client_id,
-        visit_data_dict["visit_date"],
-        visit_data_dict["visit_time"],  # Add visit_time
-        visit_data_dict.get("event_type"),
-        visit_data_dict.get("referral_source"),
-        visit_data_dict.get("follow_up"),
-        visit_data_dict.get("hra"),
-        visit_data_dict.get("edu"),
-        visit_data_dict.get("case_management"),
-        visit_data_dict.get("systolic"),
-        visit_data_dict.get("diastolic"),
-        visit_data_dict.get("cholesterol"),
-        visit_data_dict.get("fasting"),
-        visit_data_dict.get("glucose"),
-        visit_data_dict.get("height"),
-        visit_data_dict.get("weight"),
-        visit_data_dict.get("bmi"),  # Now calculated on the backend
-        visit_data_dict.get("a1c"),
-        visit_data_dict.get("acquired_by")
-    ]
-
-    # Standard insert without duplicate check (since you've removed the UNIQUE constraint)
-    cursor.execute('''
-        INSERT INTO patient_visits (
-            client_id, visit_date, visit_time, event_type, referral_source, follow_up, 
-            hra, edu, case_management, systolic, diastolic, cholesterol, 
-            fasting, glucose, height, weight, bmi, a1c, acquired_by
-        )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', visit_data)
-
-    visit_id = cursor.lastrowid  # Get the auto-generated visit ID from SQLite
-    conn.commit()
+            if goals_data:
+                # Standardize the visit date to YYYY-MM-DD format
+                standardized_visit_date = standardize_date_for_db(data["visit_date"])
 
-    # If there's a goals field in the data, create goals for this visit
-    if "goals" in data and isinstance(data["goals"], dict):
-        goals_data = {key: 1 if value else 0 for key, value in data["goals"].items()}
-
-        if goals_data:
-            # Standardize the visit date to YYYY-MM-DD format
-            standardized_visit_date = standardize_date_for_db(data["visit_date"])
-
-            if standardized_visit_date:
-                # Create a new goals record with visit_id reference
-                cursor.execute(f'''
-                    INSERT INTO patients_goals (
-                        client_id, visit_date, visit_id, {", ".join(goals_data.keys())}
-                    )
-                    VALUES (?, ?, ?, {", ".join(["?" for _ in goals_data])})
-                ''', (client_id, standardized_visit_date, visit_id) + tuple(goals_data.values()))
-            else:
-                print(f"Error: Could not convert visit date '{data['visit_date']}' to YYYY-MM-DD format")
-            conn.commit()
+                if standardized_visit_date:
+                    # Create a new goals record with visit_id reference
+                    cursor.execute(f'''
+                        INSERT INTO patients_goals (
+                            client_id, visit_date, visit_id, {", ".join(goals_data.keys())}
+                        )
+                        VALUES (?, ?, ?, {", ".join(["?" for _ in goals_data])})
+                    ''', (client_id, standardized_visit_date, visit_id) + tuple(goals_data.values()))
+                else:
+                    print(f"Error: Could not convert visit date '{data['visit_date']}' to YYYY-MM-DD format")
 
     cursor.execute("SELECT first_name || ' ' || last_name as name FROM patients WHERE client_id = ?", (client_id,))
     patient_name = cursor.fetchone()["name"]
     log_activity('create', 'visit', str(visit_id), patient_name, f"Visit date: {data['visit_date']}")
 
-    conn.close()
     return jsonify({
         "message": "Visit added successfully",
         "visit_id": visit_id,
@@ -1267,6 +1546,46 @@ def add_patient_visit(client_id):
     }), 201
 
 
+# Add many visits for a patient in one request and one transaction
+# Nested goals are not written here; post them to /patients/<client_id>/goals/bulk
+@app.route("/patients/<client_id>/visits/bulk", methods=["POST"])
+@handle_errors
+def add_patient_visits_bulk(client_id):
+    visits = request.json
+    if not visits or not isinstance(visits, list):
+        return jsonify({"error": "A list of visits is required"}), 400
+
+    # Validate every visit before writing any of them
+    for index, data in enumerate(visits):
+        if not isinstance(data, dict):
+            return jsonify({"error": f"Visit {index} is not an object"}), 400
+        validation_errors = validate_visit_data(data)
+        if validation_errors:
+            return jsonify({"error": f"Validation failed for visit {index}", "details": validation_errors}), 400
+        data["visit_date"] = standardize_date_for_db(data["visit_date"])
+        if not data["visit_date"]:
+            return jsonify({"error": f"Invalid visit date format for visit {index}. Please use YYYY-MM-DD format."}), 400
+
+    conn = db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT first_name || ' ' || last_name as name FROM patients WHERE client_id = ?", (client_id,))
+    patient = cursor.fetchone()
+    if not patient:
+        return jsonify({"error": "Patient not found"}), 404
+
+    visit_rows = [prepare_visit_row(client_id, data) for data in visits]
+
+    with transaction(conn, "IMMEDIATE"):
+        cursor.executemany(PATIENT_VISIT_INSERT_SQL, visit_rows)
+
+    log_activity('create', 'visit', client_id, patient["name"], f"Bulk import of {len(visit_rows)} visits")
+
+    return jsonify({
+        "message": "Visits added successfully",
+        "visits_added": len(visit_rows)
+    }), 201
+
+
 # Update a patient's visit
 @app.route("/patients/<client_id>/visits/<int:visit_id>", methods=["PATCH"])
 @handle_errors
@@ -1298,7 +1617,6 @@ def update_patient_visit(client_id, visit_id):
         (client_id, visit_id)
     )
     if not cursor.fetchone():
-        conn.close()
         return jsonify({"error": "Visit not found"}), 404
 
     # Calculate BMI if height and weight are present
@@ -1328,13 +1646,12 @@ def update_patient_visit(client_id, visit_id):
     # Create a copy of data without the goals field for the visit table update
     visit_data_dict = {k: v for k, v in data.items() if k != "goals"}
 
-    for key, value in visit_data_dict.items():
-        if key not in ("id", "client_id"):  # Skip primary keys
+    for key, value in sorted(visit_data_dict.items()):
+        if key in VISIT_COLUMNS:  # Skip primary keys and unknown fields
             fields.append(f"{key}=?")
             values.append(value)
 
     if not fields:
-        conn.close()
         return jsonify({"error": "No fields provided to update"}), 400
 
     # Create SQL update query
@@ -1342,32 +1659,30 @@ def update_patient_visit(client_id, visit_id):
     values.append(client_id)
     values.append(visit_id)
 
-    cursor.execute(sql, tuple(values))
-    rows_affected = cursor.rowcount
-    conn.commit()
-
-    # Handle updating goals if provided
-    if "goals" in data and isinstance(data["goals"], dict) and data.get("visit_date"):
-        goals_data = {key: 1 if value else 0 for key, value in data["goals"].items()}
-
-        if goals_data:
-            # Standardize the visit date to YYYY-MM-DD format
-            standardized_visit_date = standardize_date_for_db(data["visit_date"])
-
-            if standardized_visit_date:
-                # Build and execute the query
-                cursor.execute(f'''
-                    INSERT INTO patients_goals (client_id, visit_date, visit_id, {", ".join(goals_data.keys())})
-                    VALUES (?, ?, ?, {", ".join(["?" for _ in goals_data])})
-                    ON CONFLICT(client_id, visit_date) DO UPDATE SET
-                    visit_id = excluded.visit_id,
-                    {", ".join([f"{goal} = excluded.{goal}" for goal in goals_data.keys()])}
-                ''', (client_id, standardized_visit_date, visit_id) + tuple(goals_data.values()))
-            else:
-                print(f"Error: Could not convert visit date '{data['visit_date']}' to YYYY-MM-DD format")
-            conn.commit()
+    with transaction(conn):
+        cursor.execute(sql, tuple(values))
+        rows_affected = cursor.rowcount
+
+        # Handle updating goals if provided
+        if "goals" in data and isinstance(data["goals"], dict) and data.get("visit_date"):
+            goals_data = {key: 1 if value else 0 for key, value in sorted(data["goals"].items()) if key in GOAL_COLUMNS}
+
+            if goals_data:
+                # Standardize the visit date to YYYY-MM-DD format
+                standardized_visit_date = standardize_date_for_db(data["visit_date"])
+
+                if standardized_visit_date:
+                    # Build and execute the query
+                    cursor.execute(f'''
+                        INSERT INTO patients_goals (client_id, visit_date, visit_id, {", ".join(goals_data.keys())})
+                        VALUES (?, ?, ?, {", ".join(["?" for _ in goals_data])})
+                        ON CONFLICT(client_id, visit_date) DO UPDATE SET
+                        visit_id = excluded.visit_id,
+                        {", ".join([f"{goal} = excluded.{goal}" for goal in goals_data.keys()])}
+                    ''', (client_id, standardized_visit_date, visit_id) + tuple(goals_data.values()))
+                else:
+                    print(f"Error: Could not convert visit date '{data['visit_date']}' to YYYY-MM-DD format")
 
-    conn.close()
 
     return jsonify({
         "message": "Visit updated successfully",
@@ -1394,12 +1709,10 @@ def delete_patient_visit(client_id, visit_id):
     visit_info = cursor.fetchone()
     
     if not visit_info:
-        conn.close()
         return jsonify({"error": "Visit not found"}), 404
 
     # Begin transaction for atomicity
-    cursor.execute("BEGIN TRANSACTION")
-    try:
+    with transaction(conn):
         # Delete the visit
         cursor.execute(
             "DELETE FROM patient_visits WHERE client_id = ? AND id = ?",
@@ -1418,14 +1731,7 @@ def delete_patient_visit(client_id, visit_id):
             VALUES (?, ?, ?, ?, ?)
         ''', ('delete', 'visit', str(visit_id), visit_info["patient_name"], f"Visit date: {visit_info['visit_date']}"))
 
-        # Commit changes
-        cursor.execute("COMMIT")
-    except Exception as e:
-        cursor.execute("ROLLBACK")
-        conn.close()
-        raise e
 
-    conn.close()
     return jsonify({"message": "Visit and corresponding goals deleted successfully"})
 
 # --------- DASHBOARD ENDPOINTS ---------
@@ -1574,7 +1880,6 @@ def get_dashboard_metrics():
             elif compliance_percentage > 0:
                 compliance_change = compliance_percentage  # Absolute change if previous was 0
 
-    conn.close()
 
     return jsonify({
         "total_patients": {
@@ -1712,7 +2017,6 @@ def get_historical_trends():
 
         results["follow_up_compliance"].append(round(compliance_percentage, 1))
 
-    conn.close()
 
     return jsonify({
         "trends": results,
@@ -1847,8 +2151,6 @@ def get_recent_activity():
         import traceback
         traceback.print_exc()
         raise e
-    finally:
-        conn.close()
 
     return jsonify({
         "activities": all_activities
@@ -1862,46 +2164,40 @@ def clear_activities():
     cursor = conn.cursor()
 
     try:
-        cursor.execute("BEGIN TRANSACTION")
+        with transaction(conn):
+            # 1. Clear the activity_log table if it exists
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='activity_log'")
+            if cursor.fetchone():
+                cursor.execute("DELETE FROM activity_log")
+                print("Cleared activity_log table")
 
-        # 1. Clear the activity_log table if it exists
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='activity_log'")
-        if cursor.fetchone():
-            cursor.execute("DELETE FROM activity_log")
-            print("Cleared activity_log table")
+            # 2. Create or update a setting that disables showing direct table activities
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='system_settings'")
+            if not cursor.fetchone():
+                cursor.execute('''
+                CREATE TABLE IF NOT EXISTS system_settings (
+                    key TEXT PRIMARY KEY,
+                    value TEXT,
+                    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+                )
+                ''')
 
-        # 2. Create or update a setting that disables showing direct table activities
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='system_settings'")
-        if not cursor.fetchone():
+            # Set a flag to indicate that direct activities should be ignored
+            current_time = datetime.now().isoformat()
             cursor.execute('''
-            CREATE TABLE IF NOT EXISTS system_settings (
-                key TEXT PRIMARY KEY,
-                value TEXT,
-                updated_at TEXT DEFAULT CURRENT_TIMESTAMP
-            )
-            ''')
-
-        # Set a flag to indicate that direct activities should be ignored
-        current_time = datetime.now().isoformat()
-        cursor.execute('''
-        INSERT INTO system_settings (key, value, updated_at)
-        VALUES ('disable_direct_activities', 'true', ?)
-        ON CONFLICT(key) DO UPDATE SET
-            value = excluded.value,
-            updated_at = excluded.updated_at
-        ''', (current_time,))
-
-        cursor.execute("COMMIT")
+            INSERT INTO system_settings (key, value, updated_at)
+            VALUES ('disable_direct_activities', 'true', ?)
+            ON CONFLICT(key) DO UPDATE SET
+                value = excluded.value,
+                updated_at = excluded.updated_at
+            ''', (current_time,))
 
         return jsonify({"message": "All activities successfully cleared"})
     except Exception as e:
-        cursor.execute("ROLLBACK")
         print(f"Error clearing activities: {str(e)}")
         import traceback
         traceback.print_exc()
         return jsonify({"error": f"Failed to clear activities: {str(e)}"}), 500
-    finally:
-        conn.close()
 # ----- Helper functions -----
 
 def is_valid_date(date_str):
@@ -1978,4 +2274,6 @@ def serve(path):
 
 # Run the app
 if __name__ == "__main__":
-    app.run(debug=True, port=5000)  # Runs locally on http://127.0.0.1:5000/
\ No newline at end of file
+    # Development server; set FLASK_DEBUG=1 for the debugger and reloader. In production run under gunicorn instead:
+    #   gunicorn -k gthread -w 4 --threads 8 --pythonpath backend patient_crud_operations:app
+    app.run(debug=os.getenv("FLASK_DEBUG") == "1", port=5000, threaded=True)  # Runs locally on http://127.0.0.1:5000/
\ No newline at end of file